@@ -0,0 +1,64 @@
+#!/bin/python2
+'''
+Measures how long relentless takes to start, and checks that importing it does
+not import any of its slow optional dependencies (which should only be imported
+by the code which uses them). Exits with a non-zero status if any are imported,
+or if the median import time exceeds --max-seconds.
+
+    python benchmarks/startup.py [--repeat N] [--max-seconds S]
+'''
+
+import os
+import sys
+import argparse
+import subprocess
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Modules which should not be imported by `import relentless`.
+heavy = ['scipy', 'matplotlib', 'mplstyles', 'parampy', 'git', 'relentless.utils']
+
+probe = '''
+import sys, time
+start = time.time()
+import relentless
+elapsed = time.time() - start
+print elapsed
+print ' '.join(sorted(name for name in %r if name in sys.modules))
+''' % (heavy,)
+
+
+def measure():
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root] + filter(None, [os.environ.get('PYTHONPATH')])))
+    output = subprocess.check_output([sys.executable, '-c', probe], env=env).splitlines()
+    return float(output[0]), output[1].split() if len(output) > 1 else []
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the time taken to import relentless.')
+    parser.add_argument('--repeat', default=10, type=int)
+    parser.add_argument('--max-seconds', dest='max_seconds', default=None, type=float, help='Fail if the median import time exceeds this.')
+    args = parser.parse_args()
+
+    times = []
+    imported = set()
+    for i in range(args.repeat):
+        elapsed, modules = measure()
+        times.append(elapsed)
+        imported.update(modules)
+    times.sort()
+    median = times[len(times)//2]
+    print "import relentless: median %.3fs, min %.3fs, max %.3fs over %d runs" % (median, times[0], times[-1], len(times))
+
+    failed = False
+    if len(imported) > 0:
+        print "Imported at startup: %s" % ', '.join(sorted(imported))
+        failed = True
+    if args.max_seconds is not None and median > args.max_seconds:
+        print "Median import time exceeds %.3fs" % args.max_seconds
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
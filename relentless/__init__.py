@@ -3,3 +3,17 @@ __version__ = 0.2
 
 from computations import *
 from testers import *
+from stores import *
+from worktrees import *
+from artifacts import *
+from scheduler import *
+from affinity import *
+from statistics import *
+from results import *
+from optimisers import *
+from refinement import *
+from cluster import *
+from journal import *
+from fixtures import *
+from jobserver import *
+import tracing
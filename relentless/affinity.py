@@ -0,0 +1,134 @@
+import os
+import errno
+from multiprocessing import Queue, cpu_count
+
+
+def parse_cpu_list(spec):
+    '''
+    Parse a list of CPUs in the kernel's format (such as "0-3,8"), as used
+    in sysfs and by `taskset -c`.
+    '''
+    cpus = []
+    for part in spec.strip().split(','):
+        if part == '':
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.extend(range(int(start), int(end)+1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+def _read_cpu_list(path):
+    try:
+        with open(path) as f:
+            return parse_cpu_list(f.read())
+    except IOError:
+        return None
+
+def allowed_cpus():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('Cpus_allowed_list:'):
+                    return parse_cpu_list(line.split(':', 1)[1])
+    except IOError:
+        pass
+    return range(cpu_count())
+
+def online_cpus():
+    return _read_cpu_list('/sys/devices/system/cpu/online') or allowed_cpus()
+
+def isolated_cpus():
+    return _read_cpu_list('/sys/devices/system/cpu/isolated') or []
+
+def thread_siblings(cpu):
+    return _read_cpu_list('/sys/devices/system/cpu/cpu%d/topology/thread_siblings_list' % cpu) or [cpu]
+
+# sched_setaffinity is looked up once, here, since finding libc runs helper
+# processes, which must not happen in a forked child before it execs.
+_sched_setaffinity = None
+if not hasattr(os, 'sched_setaffinity'):
+    import ctypes, ctypes.util
+    try:
+        _sched_setaffinity = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True).sched_setaffinity
+    except (OSError, AttributeError):
+        pass
+
+def affinity_mask(cpus):
+    import ctypes
+    mask = (ctypes.c_ulong * 16)() # Room for 1024 CPUs
+    bits = 8*ctypes.sizeof(ctypes.c_ulong)
+    for cpu in cpus:
+        mask[cpu // bits] |= 1 << (cpu % bits)
+    return mask
+
+def set_affinity(pid, cpus, mask=None):
+    '''
+    Restrict `pid` (0 for this process) to `cpus`. A mask prepared with
+    `affinity_mask` may be passed, so that nothing is allocated in a child
+    before it execs (see `affinity_setter`).
+    '''
+    if hasattr(os, 'sched_setaffinity'):
+        return os.sched_setaffinity(pid, cpus)
+    import ctypes
+    if _sched_setaffinity is None:
+        raise OSError(errno.ENOSYS, "sched_setaffinity is not available.")
+    if mask is None:
+        mask = affinity_mask(cpus)
+    if _sched_setaffinity(pid, ctypes.sizeof(mask), ctypes.byref(mask)) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+def affinity_setter(cpus):
+    '''
+    Return a function (for use as a `preexec_fn`) which restricts the calling
+    process to `cpus`, with everything it needs prepared in the parent.
+    '''
+    mask = affinity_mask(cpus) if not hasattr(os, 'sched_setaffinity') else None
+    return lambda: set_affinity(0, cpus, mask=mask)
+
+
+class CorePool(object):
+    '''
+    A pool of CPUs, each handed to one run at a time (and shared with forked
+    workers).
+    `cpus` is a list, a kernel CPU list, 'all' or 'isolated'.
+    '''
+
+    def __init__(self, cpus='all', reserve_siblings=False):
+        if cpus == 'all':
+            cpus = allowed_cpus()
+        elif cpus == 'isolated':
+            cpus = isolated_cpus()
+            if len(cpus) == 0:
+                raise ValueError("No isolated CPUs are available; see the isolcpus kernel parameter.")
+        elif isinstance(cpus, basestring):
+            cpus = parse_cpu_list(cpus)
+
+        unavailable = set(cpus) - set(online_cpus())
+        if len(unavailable) > 0:
+            raise ValueError("CPUs %s are not online." % ','.join(map(str, sorted(unavailable))))
+
+        if reserve_siblings:
+            reserved = set()
+            selected = []
+            for cpu in cpus:
+                if cpu not in reserved:
+                    selected.append(cpu)
+                    reserved.update(thread_siblings(cpu))
+            cpus = selected
+
+        self.cpus = list(cpus)
+        self.__free = Queue()
+        for cpu in self.cpus:
+            self.__free.put(cpu)
+
+    def __len__(self):
+        return len(self.cpus)
+
+    def acquire(self):
+        return self.__free.get()
+
+    def release(self, cpu):
+        self.__free.put(cpu)
@@ -0,0 +1,96 @@
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import tempfile
+
+
+class ArtifactCache(object):
+    '''
+    An LRU cache (of at most `max_size` bytes) of built executables, keyed by
+    source tree and build identity.
+    '''
+
+    def __init__(self, path, max_size=1024*1024*1024):
+        self.path = path
+        self.max_size = max_size
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def key(self, *parts):
+        h = hashlib.sha1()
+        for part in parts:
+            h.update(str(part))
+            h.update('\0')
+        return h.hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.path, key)
+
+    def restore(self, key, dest):
+        '''
+        Place the artifact stored under `key` at `dest`, returning True if
+        there was one.
+        '''
+        entry = self.entry(key)
+        if not os.path.exists(entry):
+            self.__record('misses')
+            return False
+        os.utime(entry, None)
+        if os.path.lexists(dest):
+            os.remove(dest)
+        try:
+            os.link(entry, dest)
+        except OSError:
+            shutil.copy2(entry, dest)
+        self.__record('hits')
+        return True
+
+    def store(self, key, src):
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.tmp')
+        os.close(fd)
+        shutil.copy2(src, tmp)
+        os.rename(tmp, self.entry(key))
+        self.evict()
+
+    def entries(self):
+        return [self.entry(name) for name in os.listdir(self.path) if not name.startswith('.')]
+
+    def size(self):
+        return sum(os.path.getsize(entry) for entry in self.entries())
+
+    def evict(self):
+        entries = sorted(self.entries(), key=os.path.getmtime)
+        size = sum(os.path.getsize(entry) for entry in entries)
+        while size > self.max_size and len(entries) > 0:
+            entry = entries.pop(0)
+            size -= os.path.getsize(entry)
+            os.remove(entry)
+
+    def stats(self):
+        with self.__stats_file() as f:
+            stats = self.__read_stats(f)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = float(stats['hits'])/lookups if lookups > 0 else 0.
+        stats['entries'] = len(self.entries())
+        stats['size'] = self.size()
+        return stats
+
+    def __stats_file(self):
+        f = open(os.path.join(self.path, '.stats'), 'a+')
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def __read_stats(self, f):
+        f.seek(0)
+        content = f.read()
+        return json.loads(content) if content else {'hits': 0, 'misses': 0}
+
+    def __record(self, outcome):
+        with self.__stats_file() as f:
+            stats = self.__read_stats(f)
+            stats[outcome] += 1
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(stats))
@@ -0,0 +1,240 @@
+import os
+import time
+import heapq
+import socket
+import itertools
+import threading
+import traceback
+import Queue
+from multiprocessing.connection import Listener, Client, AuthenticationError
+
+from .computations import Computation
+from .scheduler import resolve_nprocs
+
+
+def parse_address(address, default_port=7227):
+    '''
+    Parse an address of the form "host:port", "host" or ":port".
+    '''
+    if isinstance(address, tuple):
+        return address
+    host, _, port = address.rpartition(':') if ':' in address else (address, None, None)
+    return (host, int(port) if port else default_port)
+
+def _authkey(authkey):
+    if authkey is None:
+        authkey = os.environ.get('RELENTLESS_AUTHKEY')
+    if not authkey:
+        raise ValueError("Connections between coordinators and workers must be authenticated: pass an authkey or set RELENTLESS_AUTHKEY.")
+    return authkey
+
+
+class Coordinator(object):
+    '''
+    A Scheduler which hands units out to `Worker`s connecting to `address`,
+    authenticated with `authkey` (by default, $RELENTLESS_AUTHKEY).
+    '''
+
+    def __init__(self, nprocs=None, builders=1, execute=None, address=('', 7227), authkey=None, started=None):
+        if execute is not None:
+            raise ValueError("Workers cannot run units through a custom execute function.")
+        self.authkey = _authkey(authkey)
+        self.listener = Listener(parse_address(address), authkey=self.authkey)
+        self.address = self.listener.address
+        self.__builds = []
+        self.__runs = []
+        self.__units = {} # id -> (priority, group, digest, task, params)
+        self.__packages = {} # digest -> package
+        self.__counter = itertools.count()
+        self.__events = Queue.Queue()
+        self.__condition = threading.Condition()
+        self.__outstanding = 0
+        self.started = started
+        self.__closed = False
+        self.__thread = threading.Thread(target=self.__accept, name='coordinator')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def build(self, group, build):
+        self.__outstanding += 1
+        self.__builds.append((group, build))
+
+    def run(self, group, computation, task, params={}, priority=0):
+        digest = computation.digest()
+        if digest not in self.__packages:
+            self.__packages[digest] = computation.package()
+        self.__outstanding += 1
+        with self.__condition:
+            unit = next(self.__counter)
+            self.__units[unit] = (priority, group, digest, task, params)
+            heapq.heappush(self.__runs, (priority, unit))
+            self.__condition.notify()
+
+    @property
+    def outstanding(self):
+        return self.__outstanding
+
+    def next_event(self):
+        if self.__outstanding == 0:
+            raise RuntimeError("No work is outstanding.")
+        if len(self.__builds) > 0:
+            group, build = self.__builds.pop(0)
+            self.__outstanding -= 1
+            return ('built', group, build())
+        while True:
+            try:
+                event = self.__events.get(timeout=1)
+                break
+            except Queue.Empty:
+                pass
+        self.__outstanding -= 1
+        if event[0] == 'error':
+            raise RuntimeError("A unit failed on a worker:\n%s" % event[2])
+        return event
+
+    def close(self):
+        with self.__condition:
+            self.__closed = True
+            self.__runs = []
+            self.__units = {}
+            self.__condition.notify_all()
+        # Wake up the listener with a connection of our own.
+        host, port = self.address
+        try:
+            Client((host if host not in ('', '0.0.0.0') else '127.0.0.1', port), authkey=self.authkey).close()
+        except (socket.error, EOFError, AuthenticationError):
+            pass
+        self.__thread.join()
+        self.listener.close()
+
+    def __accept(self):
+        while True:
+            try:
+                connection = self.listener.accept()
+            except (AuthenticationError, EOFError, IOError, socket.error):
+                if self.__closed:
+                    break
+                continue
+            if self.__closed:
+                connection.close()
+                break
+            thread = threading.Thread(target=self.__serve, args=(connection,), name='coordinator-connection')
+            thread.daemon = True
+            thread.start()
+
+    def __next_unit(self):
+        with self.__condition:
+            while not self.__closed:
+                if len(self.__runs) > 0:
+                    _, unit = heapq.heappop(self.__runs)
+                    return unit, self.__units[unit]
+                self.__condition.wait(1)
+        return None, None
+
+    def __serve(self, connection):
+        held = None
+        try:
+            while True:
+                message = connection.recv()
+                if message[0] == 'fetch':
+                    connection.send(('package', message[1], self.__packages[message[1]]))
+                    continue
+                if message[0] in ('result', 'error'):
+                    with self.__condition:
+                        unit = self.__units.pop(message[1], None)
+                        held = None
+                    if unit is not None:
+                        _, group, _, task, params = unit
+                        if message[0] == 'result':
+                            self.__events.put(('result', group, (task, params), message[2]))
+                        else:
+                            self.__events.put(('error', group, message[2]))
+                held, unit = self.__next_unit()
+                if held is None:
+                    connection.send(('stop',))
+                    break
+                _, _, digest, task, params = unit
+                connection.send(('unit', held, digest, task, params))
+                if self.started is not None:
+                    self.started() # As near as we know to when the worker starts it
+        except (EOFError, IOError, socket.error):
+            pass # The worker has gone; its unit is handed out again below.
+        finally:
+            with self.__condition:
+                if held is not None and held in self.__units and not self.__closed:
+                    heapq.heappush(self.__runs, (self.__units[held][0], held))
+                    self.__condition.notify()
+            connection.close()
+
+
+class Worker(object):
+    '''
+    Runs units from the Coordinator at `address`, `nprocs` at a time, until it
+    has no more work (or for ever, if `forever`).
+    '''
+
+    def __init__(self, address, authkey=None, nprocs=None, path='_relentless_worker', src_dir=None, forever=True):
+        self.address = parse_address(address)
+        if self.address[0] == '':
+            self.address = ('127.0.0.1', self.address[1])
+        self.authkey = _authkey(authkey)
+        self.nprocs = resolve_nprocs(nprocs)
+        self.path = os.path.abspath(path)
+        self.src_dir = src_dir
+        self.forever = forever
+        self.__computations = {}
+        self.__lock = threading.Lock()
+
+    def serve(self):
+        threads = [threading.Thread(target=self.__work, name='worker-%d' % i) for i in range(self.nprocs)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(1) # A timeout keeps the wait interruptible.
+        finally:
+            for computation in self.__computations.values():
+                computation.close()
+
+    def __work(self):
+        while True:
+            try:
+                connection = Client(self.address, authkey=self.authkey)
+            except (socket.error, EOFError):
+                if not self.forever:
+                    return
+                time.sleep(1)
+                continue
+            try:
+                self.__session(connection)
+            except (EOFError, IOError, socket.error):
+                pass # The coordinator has gone.
+            finally:
+                connection.close()
+            if not self.forever:
+                return
+            time.sleep(1)
+
+    def __session(self, connection):
+        connection.send(('ready',))
+        while True:
+            message = connection.recv()
+            if message[0] == 'stop':
+                return
+            _, unit, digest, task, params = message
+            try:
+                result = self.__computation(connection, digest).run(task, params=params)
+            except Exception:
+                connection.send(('error', unit, traceback.format_exc()))
+            else:
+                connection.send(('result', unit, result))
+
+    def __computation(self, connection, digest):
+        with self.__lock:
+            if digest not in self.__computations:
+                connection.send(('fetch', digest))
+                _, _, package = connection.recv()
+                self.__computations[digest] = Computation.unpackage(package, os.path.join(self.path, digest), src_dir=self.src_dir)
+            return self.__computations[digest]
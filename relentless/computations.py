@@ -1,18 +1,38 @@
 import os
 import re
+import hashlib
+import signal
 import subprocess
 import time
+import threading
 from multiprocessing import Lock, Value
 from abc import abstractmethod, ABCMeta
 
+from .process import ChildProcess, Limits, OutputCapture
+from .affinity import affinity_setter
+from .harness import Harness
+from .fixtures import FixtureCache
+from . import tracing
+
 class Computation(object):
 
-    def __init__(self, project, working_dir=".", src_dir=None, **kwargs):
+    # Lines of output reporting metrics of a run, such as "Score = 10"
+    metric = re.compile('([A-Za-z0-9 ]+) = ([A-Za-z0-9]+)')
+
+    # Patterns in the output of a run which has failed for want of memory
+    out_of_memory = re.compile('bad_alloc|MemoryError|OutOfMemoryError|Cannot allocate memory|[Oo]ut of memory')
+
+    def __init__(self, project, working_dir=".", src_dir=None, time_limit=None, cpu_limit=None, memory_limit=None, cores=None, output_limit=256*1024, log_dir=None, jobserver=None, **kwargs):
         self.project = project
         self.working_dir = os.path.abspath(working_dir)
         if src_dir is None:
             src_dir = self.working_dir
         self.src_dir = os.path.abspath(src_dir)
+        self.limits = Limits(time=time_limit, cpu=cpu_limit, memory=memory_limit)
+        self.cores = cores # A CorePool from which each run is given a dedicated CPU
+        self.output_limit = output_limit # Bytes retained from each end of each output stream
+        self.log_dir = log_dir # If not None, where the full output of every run is kept
+        self.jobserver = jobserver # If not None, a Jobserver shared with other builds, for parallel make
         self.compiled=Value('i',0)
         self.lock = Lock()
         self.init(**kwargs)
@@ -20,52 +40,214 @@ class Computation(object):
     def init(self):
         pass
 
+    def close(self):
+        # Stop anything kept running between runs.
+        pass
+
     def compile(self):
         with self.lock:
             if not self.compiled.value > 0:
-                self._compile()
+                with tracing.span('compile', project=self.project, working_dir=self.working_dir):
+                    self._compile()
                 self.compiled.value=1
 
     def _compile(self):
         raise NotImplementedError()
 
-    def run(self, task=0, params={}):
+    def digest(self):
+        '''
+        Return a hash of the built artifact together with everything else that
+        determines how it is run (see `identity`). Results computed by
+        computations sharing a digest are interchangeable.
+        '''
+        if getattr(self, '_digest', None) is None:
+            self.compile()
+            h = hashlib.sha1()
+            for part in self.identity() + [self.limits]:
+                h.update(str(part))
+                h.update('\0')
+            self._digest = h.hexdigest()
+        return self._digest
+
+    def identity(self):
+        raise NotImplementedError()
+
+    def package(self):
+        '''
+        What is needed to run this computation on another host (see
+        `unpackage`).
+        '''
         raise NotImplementedError()
 
+    @staticmethod
+    def unpackage(package, working_dir, src_dir=None, **kwargs):
+        '''
+        Recreate a packaged computation in `working_dir`, ready to run without
+        being built again.
+        '''
+        for name, data in package['files'].items():
+            path = os.path.join(working_dir, name)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.chmod(path + '.tmp', 0755)
+            os.rename(path + '.tmp', path)
+        options = dict(package['options'], **kwargs)
+        computation = package['type'](package['project'], working_dir=working_dir, src_dir=src_dir, **options)
+        computation.compiled.value = 1
+        return computation
+
+    def command(self, task=0, vis=False, params={}):
+        '''
+        Return the args and kwargs with which to start the process for `task`,
+        as a tuple (args, kwargs).
+        '''
+        raise NotImplementedError()
+
+    def run(self, task=0, vis=False, params={}):
+        args, kwargs = self.command(task, vis=vis, params=params)
+        return self._run(task, params, *args, **kwargs)
+
+    def start(self, task=0, params={}):
+        '''
+        Start the process for `task` without waiting for it, returning a
+        ChildProcess which should be driven to completion (see `ChildProcess`)
+        and then passed to `finish`.
+        '''
+        args, kwargs = self.command(task, params=params)
+        return self._start(task, params, *args, **kwargs)
+
+    def parse_line(self, line):
+        return [(m.group(1).lower(), m.group(2)) for m in self.metric.finditer(line)]
+
     def process_result(self, result):
-        for m in re.finditer('([A-Za-z0-9 ]+) = ([A-Za-z0-9]+)', result.stdout+result.stderr):
-            gs = m.groups()
-            result.info[gs[0].lower()] = gs[1]
         return result
 
     def _run(self, task, params, *args, **kwargs):
+        p = self._start(task, params, *args, **kwargs)
+        try:
+            p.communicate()
+        except:
+            self.release(p)
+            raise
+        return self.finish(p)
+
+    def _start(self, task, params, *args, **kwargs):
         if not self.compiled.value > 0:
             self.compile()
-        defaults={'stdout':subprocess.PIPE, 'stderr':subprocess.PIPE}
+        defaults={'stdout':subprocess.PIPE, 'stderr':subprocess.PIPE, 'close_fds':True}
         defaults.update(kwargs)
-        t = time.time()
-        p = subprocess.Popen(*args, **defaults)
-        stdout, stderr = p.communicate()
-        result = ComputationResult(task, params, runtime=time.time()-t, stdout=stdout, stderr=stderr)
-        result(returncode=p.returncode)
-        if result.returncode != 0:
+        cpu = None
+        if self.cores is not None:
+            cpu = self.cores.acquire()
+            defaults['preexec_fn'] = affinity_setter([cpu])
+        try:
+            p = ChildProcess(*args, limits=self.limits, capture=lambda name: self.capture(task, name), **defaults)
+        except:
+            if cpu is not None:
+                self.cores.release(cpu)
+            raise
+        finally:
+            if isinstance(defaults.get('stdin'), file):
+                defaults['stdin'].close() # The child has its own copy
+        p.task, p.params, p.cpu = task, params, cpu
+        return p
+
+    def capture(self, task, name):
+        return OutputCapture(head=self.output_limit, tail=self.output_limit, parse=self.parse_line, spill=self.log_dir, prefix='task%s-' % task, suffix='.%s' % name)
+
+    def release(self, p):
+        if p.cpu is not None:
+            self.cores.release(p.cpu)
+            p.cpu = None
+
+    def finish(self, p):
+        end = time.time()
+        tracing.record('run', end - p.usage['wall_time'], end, task=p.task)
+        cpu = p.cpu
+        self.release(p)
+        stdout, stderr = p.stdout, p.stderr
+        result = ComputationResult(p.task, p.params, runtime=p.usage['wall_time'], stdout=stdout, stderr=stderr)
+        result(returncode=p.returncode, status=self.status(p, stdout, stderr), cpu=cpu, **p.usage)
+        for name in ('stdout', 'stderr'):
+            if name in p.output:
+                result.info.update(p.output[name].metrics)
+                if p.output[name].path is not None:
+                    result.info[name + '_log'] = p.output[name].path
+        if result.returncode != 0 and result.status == 'RE':
             print result.stdout
             print result.stderr
         return self.process_result(result)
 
+    def status(self, process, stdout, stderr):
+        '''
+        Classify a finished run as 'OK', 'TLE', 'MLE' or 'RE'.
+        '''
+        if process.timed_out or process.returncode == -signal.SIGXCPU:
+            return 'TLE'
+        if self.limits.cpu is not None and process.usage.get('cpu_time', 0) >= self.limits.cpu:
+            return 'TLE'
+        if self.limits.memory is not None and self.out_of_memory.search(stdout+stderr):
+            return 'MLE'
+        if process.returncode != 0:
+            return 'RE'
+        return 'OK'
+
 class SimpleComputation(Computation):
 
-    def init(self, wrapper=None, wrapper_vis=None):
+    def init(self, wrapper=None, wrapper_vis=None, artifacts=None, source=None, generator=None, fixture_dir=None):
         self.wrapper = wrapper
         self.wrapper_vis = wrapper_vis
+        self.artifacts = artifacts # An ArtifactCache, used if the source is known
+        self.source = source # A hash identifying the source tree, such as a git tree sha
+        # If not None, the command which generates the input of each task (see
+        # FixtureCache), which is given to each run as its stdin, and
+        # substituted for %(fixture)s in wrapper commands.
+        self.generator = generator
+        self.fixtures = None
+        if generator is not None:
+            if fixture_dir is None:
+                fixture_dir = os.path.join(self.working_dir, '_fixtures')
+            self.fixtures = FixtureCache(fixture_dir, generator, src_dir=self.src_dir, working_dir=self.working_dir)
+
+    @property
+    def makefile(self):
+        if os.path.exists(os.path.join(self.working_dir, 'Makefile')):
+            return None
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)),'Makefile')
+
+    def build_identity(self):
+        makefile = None
+        if self.makefile is not None:
+            with open(self.makefile) as f:
+                makefile = hashlib.sha1(f.read()).hexdigest()
+        return [self.__class__.__name__, self.project, makefile, self.wrapper]
 
     def _compile(self):
+        executable = os.path.join(self.working_dir, self.project)
+        key = None
+        if self.artifacts is not None and self.source is not None:
+            key = self.artifacts.key(self.source, *self.build_identity())
+            with tracing.span('artifact restore'):
+                if self.artifacts.restore(key, executable):
+                    return
+        if os.path.exists(executable) and os.stat(executable).st_nlink > 1:
+            os.remove(executable) # Never build over a file shared with the artifact cache.
+
         f = open(os.path.join(self.working_dir, 'compile.log'),'w')
-        if os.path.exists(os.path.join(self.working_dir, 'Makefile')):
-            compile = subprocess.Popen(["make",os.path.basename(self.project)],cwd=self.working_dir, stdout=f, stderr=f)
-        else:
-            compile = subprocess.Popen(["make","-f",os.path.join(os.path.dirname(os.path.abspath(__file__)),'Makefile'),os.path.basename(self.project)],cwd=self.working_dir, stdout=f, stderr=f)
-        compile.wait()
+        with tracing.span('make'):
+            token = self.jobserver.acquire() if self.jobserver is not None else None
+            env = self.jobserver.environ() if self.jobserver is not None else None
+            try:
+                if self.makefile is None:
+                    compile = subprocess.Popen(["make",os.path.basename(self.project)],cwd=self.working_dir, stdout=f, stderr=f, env=env)
+                else:
+                    compile = subprocess.Popen(["make","-f",self.makefile,os.path.basename(self.project)],cwd=self.working_dir, stdout=f, stderr=f, env=env)
+                compile.wait()
+            finally:
+                if token is not None:
+                    self.jobserver.release(token)
         f.close()
         if compile.returncode != 0:
             f = open(os.path.join(self.working_dir, 'compile.log'),'r')
@@ -73,7 +255,38 @@ class SimpleComputation(Computation):
             f.close()
             raise RuntimeError("Code did not compile successfully. See the compile.log in the source tree at %s; or see above." % os.path.join(self.working_dir, 'compile.log'))
 
-    def run(self,task=0,vis=False,params={}):
+        if key is not None:
+            with tracing.span('artifact store'):
+                self.artifacts.store(key, executable)
+
+    def identity(self):
+        h = hashlib.sha1()
+        with open(os.path.join(self.working_dir, self.project), 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), ''):
+                h.update(chunk)
+        if self.fixtures is not None:
+            return [self.__class__.__name__, h.hexdigest(), self.wrapper] + self.fixtures.identity()
+        return [self.__class__.__name__, h.hexdigest(), self.wrapper]
+
+    def options(self):
+        options = {
+            'wrapper': self.wrapper,
+            'wrapper_vis': self.wrapper_vis,
+            'time_limit': self.limits.time,
+            'cpu_limit': self.limits.cpu,
+            'memory_limit': self.limits.memory
+        }
+        if self.generator is not None:
+            options['generator'] = self.generator
+        return options
+
+    def package(self):
+        self.compile()
+        with open(os.path.join(self.working_dir, self.project), 'rb') as f:
+            executable = f.read()
+        return {'type': self.__class__, 'project': self.project, 'options': self.options(), 'files': {self.project: executable}}
+
+    def command(self,task=0,vis=False,params={}):
         env = os.environ.copy()
         for variable in params:
             env["RELENTLESS_%s" % variable] = str(params[variable])
@@ -82,31 +295,94 @@ class SimpleComputation(Computation):
         if vis and self.wrapper_vis is not None:
             wrapper = self.wrapper_vis
 
+        fixture = None
+        if self.fixtures is not None:
+            fixture = self.fixtures.fixture(task)
+
         if wrapper is None:
             cmd = [os.path.join(self.working_dir, self.project)]
         else:
-            command = wrapper % {  'project': os.path.join(self.working_dir, self.project),
+            substitutions = {  'project': os.path.join(self.working_dir, self.project),
                                         'src_dir': self.src_dir,
                                         'working_dir': self.working_dir,
                                         'task': task}
-            cmd = command.split()
+            if fixture is not None:
+                substitutions['fixture'] = fixture
+            cmd = (wrapper % substitutions).split()
 
-        return self._run(task, params, cmd, env=env, cwd=self.working_dir)
+        kwargs = {'env': env, 'cwd': self.working_dir}
+        if fixture is not None:
+            # The child reads its input from the cached file itself, rather
+            # than through a pipe fed by us.
+            kwargs['stdin'] = open(fixture, 'rb')
+        return [cmd], kwargs
 
 
 class MarathonComputation(SimpleComputation):
 
-    def init(self, wrapper=None, wrapper_vis=None):
+    def init(self, wrapper=None, wrapper_vis=None, harness=None, **kwargs):
         if wrapper is None:
             wrapper = "java -jar %(src_dir)s/tester.jar -exec %(project)s -seed %(task)s -novis"
         if wrapper_vis is None:
             wrapper_vis = "java -jar %(src_dir)s/tester.jar -exec %(project)s -seed %(task)s"
-        self.wrapper = wrapper
-        self.wrapper_vis = wrapper_vis
+        SimpleComputation.init(self, wrapper=wrapper, wrapper_vis=wrapper_vis, **kwargs)
+        # If not None, the command of a persistent tester (see Harness) which
+        # runs the tasks of each worker in turn, in place of `wrapper`.
+        self.harness = harness
+        self.__harnesses = {}
+        self.__harnesses_lock = threading.Lock()
+
+    def identity(self):
+        if self.harness is None:
+            return SimpleComputation.identity(self)
+        return SimpleComputation.identity(self) + [self.harness]
+
+    def options(self):
+        options = SimpleComputation.options(self)
+        if self.harness is not None:
+            options['harness'] = self.harness
+        return options
+
+    def run(self, task=0, vis=False, params={}):
+        if self.harness is None or vis:
+            return SimpleComputation.run(self, task, vis=vis, params=params)
+        if not self.compiled.value > 0:
+            self.compile()
+        harness = self.__harness()
+        # The CPU is held for the task only, since a harness in a forked
+        # worker may never be closed by the process which owns the pool.
+        cpu = self.cores.acquire() if self.cores is not None else None
+        try:
+            run = harness.run(task, params, self.capture(task, 'stdout'), self.capture(task, 'stderr'), cpu=cpu)
+        except:
+            if cpu is not None:
+                self.cores.release(cpu)
+            raise
+        result = self.finish(run)
+        result(harness_starts=harness.starts)
+        return result
+
+    def __harness(self):
+        # Each worker (thread or process) has a harness of its own.
+        key = (os.getpid(), threading.current_thread().ident)
+        with self.__harnesses_lock:
+            if key not in self.__harnesses:
+                command = self.harness % {'project': os.path.join(self.working_dir, self.project),
+                                            'src_dir': self.src_dir,
+                                            'working_dir': self.working_dir}
+                self.__harnesses[key] = Harness(command.split(), limits=self.limits, cwd=self.working_dir)
+            return self.__harnesses[key]
+
+    def close(self):
+        with self.__harnesses_lock:
+            for key, harness in self.__harnesses.items():
+                if key[0] == os.getpid():
+                    harness.stop()
+                    del self.__harnesses[key]
 
 class ComputationResult(object):
 
-    minimise = ['runtime']
+    minimise = ['runtime', 'wall_time', 'cpu_time', 'cpu_user', 'cpu_system', 'max_rss']
 
     def __init__(self, task, params, stdout, stderr, runtime):
         self.info = {}
@@ -128,14 +404,22 @@ class ComputationResult(object):
             return self.info[key]
         raise AttributeError()
 
+    @property
+    def status(self):
+        return self.info.get('status', 'OK')
+
     @property
     def score(self):
+        if self.status in ('TLE', 'MLE'):
+            return 0. # Runs which exceeded their limits are scored as failures, as in contests.
         if 'score' in self.info:
             return float(self.info['score'])
         return -1
         #raise ValueError("No score available in the info dictionary.")
 
     def __str__(self):
+        if self.status in ('TLE', 'MLE'):
+            return "<ComputationResult with status %s>" % self.status
         return "<ComputationResult with score %f>" % self.score
 
     def __repr__(self):
@@ -157,7 +441,7 @@ class ComputationResult(object):
         info_keys = self.info.keys()
 
 
-        for key in ["score", "runtime"]:
+        for key in ["status", "score", "runtime"]:
             if key in self.info:
                 print " - %s: %s" % (key, self.info[key])
                 info_keys.remove(key)
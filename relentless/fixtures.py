@@ -0,0 +1,116 @@
+import os
+import fcntl
+import hashlib
+import tempfile
+import subprocess
+
+from . import tracing
+
+
+def generator_command(generator, task, src_dir='.', working_dir='.'):
+    return (generator % {'task': task, 'src_dir': src_dir, 'working_dir': working_dir}).split()
+
+
+def generator_identity(generator, src_dir='.', working_dir='.'):
+    '''
+    The generator command, together with the contents of the files it names
+    (such as the generator itself), so that inputs are made again when the
+    generator changes.
+    '''
+    identity = [generator]
+    for arg in generator_command(generator, 0, src_dir, working_dir):
+        if os.path.isfile(arg):
+            h = hashlib.sha1()
+            with open(arg, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 16), ''):
+                    h.update(chunk)
+            identity.append(h.hexdigest())
+    return identity
+
+
+class FixtureCache(object):
+    '''
+    Inputs of tasks made by `generator`, each generated once and stored
+    under the hash of its contents.
+    '''
+
+    def __init__(self, path, generator, src_dir='.', working_dir='.'):
+        self.path = path
+        self.generator = generator
+        self.src_dir = src_dir
+        self.working_dir = working_dir
+        for directory in ('objects', 'tasks'):
+            if not os.path.exists(os.path.join(self.path, directory)):
+                try:
+                    os.makedirs(os.path.join(self.path, directory))
+                except OSError:
+                    pass # Made by another worker in the meantime
+
+    def command(self, task):
+        return generator_command(self.generator, task, self.src_dir, self.working_dir)
+
+    def identity(self):
+        if getattr(self, '_identity', None) is None:
+            self._identity = generator_identity(self.generator, self.src_dir, self.working_dir)
+        return self._identity
+
+    def key(self, task):
+        return hashlib.sha1(repr((self.identity(), str(task)))).hexdigest()
+
+    def get(self, task):
+        '''
+        Return the path of the input of `task`, or None if it has not been
+        generated.
+        '''
+        try:
+            with open(os.path.join(self.path, 'tasks', self.key(task))) as f:
+                digest = f.read().strip()
+        except IOError:
+            return None
+        path = os.path.join(self.path, 'objects', digest)
+        return path if os.path.exists(path) else None
+
+    def fixture(self, task):
+        '''
+        Return the path of the input of `task`, generating it if need be.
+        '''
+        path = self.get(task)
+        if path is not None:
+            return path
+        key = self.key(task)
+        with open(os.path.join(self.path, 'tasks', key + '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                path = self.get(task)
+                if path is None:
+                    with tracing.span('fixture', task=task):
+                        path = self.generate(task, key)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return path
+
+    def generate(self, task, key):
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self.path, 'objects'), prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                generator = subprocess.Popen(self.command(task), stdout=f, stderr=subprocess.PIPE, cwd=self.working_dir, close_fds=True)
+                _, stderr = generator.communicate()
+            if generator.returncode != 0:
+                print stderr
+                raise RuntimeError("The input of task %s could not be generated by '%s' (exit status %d); see above." % (task, self.generator, generator.returncode))
+            h = hashlib.sha1()
+            with open(tmp, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 16), ''):
+                    h.update(chunk)
+            path = os.path.join(self.path, 'objects', h.hexdigest())
+            os.chmod(tmp, 0444)
+            os.rename(tmp, path)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        entry = os.path.join(self.path, 'tasks', key)
+        with open(entry + '.tmp', 'w') as f:
+            f.write(h.hexdigest())
+        os.rename(entry + '.tmp', entry)
+        return path
@@ -0,0 +1,209 @@
+import os
+import errno
+import signal
+import select
+import subprocess
+
+from .process import Limits, monotonic, started_group, finished_group
+from .affinity import affinity_setter, set_affinity
+
+
+class HarnessError(RuntimeError):
+    pass
+
+
+class HarnessRun(object):
+    '''
+    The outcome of a task run by a Harness, which can be passed to
+    `Computation.finish` in place of a ChildProcess.
+    '''
+
+    def __init__(self, task, params, returncode, timed_out, usage, output, cpu=None):
+        self.task = task
+        self.params = params
+        self.returncode = returncode
+        self.timed_out = timed_out
+        self.usage = usage
+        self.output = output
+        self.cpu = cpu # The CPU the task ran on, released by `Computation.finish`
+
+    @property
+    def stdout(self):
+        return self.output['stdout'].text
+
+    @property
+    def stderr(self):
+        return self.output['stderr'].text
+
+
+class Harness(object):
+    '''
+    A long-lived process which runs one task after another (such as a JVM
+    tester), each requested with a line "<task> [<key>=<value> ...]" on its
+    stdin and answered on its stdout up to a line `end`.
+    '''
+
+    end = 'RELENTLESS END'
+    cpu_interval = 0.1
+
+    def __init__(self, args, limits=None, preexec_fn=None, cpu=None, **kwargs):
+        self.args = args
+        self.limits = limits if limits is not None else Limits()
+        self.preexec_fn = preexec_fn
+        self.cpu = cpu # The CPU to which the harness is pinned, if any (see `pin`)
+        self.kwargs = kwargs
+        self.process = None
+        self.starts = 0
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process is not None else None
+
+    def start(self):
+        limits = Limits(memory=self.limits.memory) # Time limits apply to each task instead
+        pin = affinity_setter([self.cpu]) if self.cpu is not None else None
+        def setup():
+            os.setpgid(0, 0)
+            limits.apply()
+            if pin is not None:
+                pin()
+            if self.preexec_fn is not None:
+                self.preexec_fn()
+        self.process = subprocess.Popen(self.args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True, preexec_fn=setup, **self.kwargs)
+        started_group(self.process.pid)
+        self.buffer = ''
+        self.starts += 1
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError, e:
+            if e.errno != errno.ESRCH:
+                raise
+        self.process.wait()
+        finished_group(self.process.pid)
+        for stream in (self.process.stdin, self.process.stdout, self.process.stderr):
+            stream.close()
+        self.process = None
+
+    def pin(self, cpu):
+        # Move every thread of the harness to `cpu`; the processes it starts
+        # from now on follow it there.
+        self.cpu = cpu
+        if self.process is None or self.process.poll() is not None:
+            return
+        try:
+            threads = os.listdir('/proc/%d/task' % self.process.pid)
+        except OSError:
+            return
+        for thread in threads:
+            try:
+                set_affinity(int(thread), [cpu])
+            except OSError, e:
+                if e.errno != errno.ESRCH:
+                    raise
+
+    def cpu_time(self):
+        # The CPU time of the processes in the harness's group (such as the
+        # solution run by a tester) and of the children they have reaped,
+        # which is not yet available from our own resource usage of children.
+        ticks = None
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            try:
+                with open('/proc/%s/stat' % pid) as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+                if int(fields[2]) == self.process.pid:
+                    # utime, stime, cutime and cstime
+                    ticks = (ticks or 0) + sum(int(field) for field in fields[11:15])
+            except (IOError, IndexError, ValueError):
+                pass # Exited in the meantime
+        return ticks/float(os.sysconf('SC_CLK_TCK')) if ticks is not None else None
+
+    def run(self, task, params, stdout, stderr, cpu=None):
+        '''
+        Run `task` with `params` (on `cpu`, if given), returning a HarnessRun.
+        '''
+        if cpu is not None and cpu != self.cpu:
+            self.pin(cpu)
+        if self.process is None or self.process.poll() is not None:
+            self.stop()
+            self.start()
+
+        request = ' '.join([str(task)] + ['%s=%s' % (key, value) for key, value in sorted(params.items())])
+        if '\n' in request:
+            raise HarnessError("Tasks and parameters sent to a harness may not contain newlines.")
+
+        start = monotonic()
+        cpu_start = self.cpu_time()
+        try:
+            self.process.stdin.write(request + '\n')
+            self.process.stdin.flush()
+        except IOError, e:
+            if e.errno != errno.EPIPE:
+                raise
+
+        deadline = start + self.limits.time if self.limits.time is not None else None
+        streams = {self.process.stdout.fileno(): stdout, self.process.stderr.fileno(): stderr}
+        done = exited = timed_out = cpu_exceeded = False
+        while not done and not exited:
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - monotonic()
+                if timeout <= 0:
+                    timed_out = True
+                    break
+            if self.limits.cpu is not None and cpu_start is not None:
+                cpu = self.cpu_time()
+                if cpu is not None and cpu - cpu_start >= self.limits.cpu:
+                    cpu_exceeded = True
+                    break
+                timeout = min(timeout, self.cpu_interval) if timeout is not None else self.cpu_interval
+            try:
+                ready, _, _ = select.select(streams.keys(), [], [], timeout)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd in ready:
+                chunk = os.read(fd, 65536)
+                if fd == self.process.stderr.fileno():
+                    if chunk:
+                        stderr.write(chunk)
+                    else:
+                        del streams[fd]
+                elif not chunk:
+                    exited = True
+                else:
+                    lines = (self.buffer + chunk).split('\n')
+                    self.buffer = lines.pop()
+                    for line in lines:
+                        if done:
+                            continue # Output after the end marker is not expected, and is discarded.
+                        if line == self.end:
+                            done = True
+                        else:
+                            stdout.write(line + '\n')
+        end = monotonic()
+        cpu_end = self.cpu_time() if not exited else None
+
+        returncode = 0
+        if timed_out:
+            returncode = -signal.SIGKILL
+            self.stop()
+        elif cpu_exceeded:
+            returncode = -signal.SIGXCPU # As though it had run into RLIMIT_CPU
+            self.stop()
+        elif exited:
+            returncode = self.process.wait() or 1 # Exiting before the task is done is a failure
+            self.stop()
+        stdout.close()
+        stderr.close()
+
+        usage = {'wall_time': end - start}
+        if cpu_start is not None and cpu_end is not None:
+            usage['cpu_time'] = cpu_end - cpu_start
+        return HarnessRun(task, params, returncode, timed_out, usage, {'stdout': stdout, 'stderr': stderr}, cpu=cpu)
@@ -0,0 +1,52 @@
+import os
+import errno
+from contextlib import contextmanager
+
+
+class Jobserver(object):
+    '''
+    A GNU make jobserver, so that concurrent builds run at most `jobs` jobs
+    between them.
+    '''
+
+    def __init__(self, jobs):
+        self.jobs = max(1, int(jobs))
+        self.read_fd, self.write_fd = os.pipe()
+        os.write(self.write_fd, '+'*self.jobs)
+
+    def acquire(self):
+        while True:
+            try:
+                return os.read(self.read_fd, 1)
+            except OSError, e:
+                if e.errno != errno.EINTR:
+                    raise
+
+    def release(self, token):
+        os.write(self.write_fd, token)
+
+    @contextmanager
+    def slot(self):
+        token = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(token)
+
+    def environ(self, env=None):
+        '''
+        Return a copy of `env` (by default, this process's environment) which
+        makes make use the jobserver. The pipe is inherited by make, and so
+        should not be closed in the child.
+        '''
+        env = dict(os.environ if env is None else env)
+        # The older name of --jobserver-auth, which every version accepts
+        env['MAKEFLAGS'] = '-j --jobserver-fds=%d,%d' % (self.read_fd, self.write_fd)
+        return env
+
+    def close(self):
+        for fd in (self.read_fd, self.write_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
@@ -0,0 +1,57 @@
+import os
+import cPickle as pickle
+
+
+class Journal(object):
+    '''
+    An append-only record of the results of a sweep, by cache key, so that an
+    interrupted sweep can be resumed.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.entries = {}
+        self.__load()
+        self.__file = open(path, 'ab')
+
+    def __load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r+b') as f:
+            valid = 0
+            while True:
+                try:
+                    key, result = pickle.load(f)
+                except Exception:
+                    break # The end of the journal, or a record cut short
+                self.entries[key] = result
+                valid = f.tell()
+            # Later records are appended after the last complete one.
+            f.truncate(valid)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        return self.entries.get(key, default)
+
+    def append(self, key, result):
+        self.entries[key] = result
+        pickle.dump((key, result), self.__file, pickle.HIGHEST_PROTOCOL)
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+
+    def close(self):
+        if not self.__file.closed:
+            self.__file.close()
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
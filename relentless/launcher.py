@@ -0,0 +1,43 @@
+'''
+Run a command in a child, writing its resource usage to <report>; see
+ChildProcess.
+
+Usage: python -S -E launcher.py <report> <command> [<arg> ...]
+'''
+import os
+import sys
+import time
+import errno
+import signal
+import resource
+
+
+def main(report, args):
+    start = time.time()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.execvp(args[0], args)
+        except OSError, e:
+            sys.stderr.write("%s: %s\n" % (args[0], e.strerror))
+        os._exit(127)
+    while True:
+        try:
+            _, status, rusage = os.wait4(pid, 0)
+            break
+        except OSError, e:
+            if e.errno != errno.EINTR:
+                raise
+    with open(report, 'w') as f:
+        f.write('%r %r %r %d\n' % (time.time() - start, rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss))
+    if os.WIFSIGNALED(status):
+        # Die of the same signal, without dumping core a second time.
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+        signal.signal(os.WTERMSIG(status), signal.SIG_DFL)
+        os.kill(os.getpid(), os.WTERMSIG(status))
+        os._exit(128 + os.WTERMSIG(status))
+    os._exit(os.WEXITSTATUS(status))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], sys.argv[2:])
@@ -0,0 +1,107 @@
+import math
+
+import numpy as np
+
+
+class DifferentialEvolution(object):
+    '''
+    Differential evolution (DE/rand/1/bin) of the params within `bounds`, with
+    trials run on successively more tasks (`rungs` rungs, growing by `eta`).
+    '''
+
+    def __init__(self, bounds, popsize=None, generations=20, mutation=0.7, crossover=0.9, rungs=3, eta=2, integers=(), seed=None):
+        if len(bounds) == 0:
+            raise ValueError("Need at least one parameter to optimise.")
+        self.names = sorted(bounds)
+        self.lower = np.array([bounds[name][0] for name in self.names], dtype=float)
+        self.upper = np.array([bounds[name][1] for name in self.names], dtype=float)
+        if np.any(self.lower > self.upper):
+            raise ValueError("Lower bounds must not exceed upper bounds.")
+        self.popsize = popsize if popsize is not None else max(5, 5*len(self.names))
+        if self.popsize < 4:
+            raise ValueError("Need a population of at least 4.")
+        self.generations = generations
+        self.mutation = mutation
+        self.crossover = crossover
+        self.rungs = max(1, rungs)
+        self.eta = eta
+        self.integers = set(integers)
+        self.seed = seed
+        self.scores = {} # (candidate, task) -> score
+        self.best = None
+        self.best_score = None
+
+    def candidate(self, x):
+        params = {}
+        for name, value in zip(self.names, x):
+            params[name] = int(round(value)) if name in self.integers else float(value)
+        return params
+
+    def subsets(self, tasks):
+        '''
+        The prefixes of `tasks` on which trials are evaluated in turn.
+        '''
+        sizes = []
+        for rung in reversed(range(self.rungs)):
+            size = int(math.ceil(len(tasks)/float(self.eta**rung)))
+            if size not in sizes:
+                sizes.append(size)
+        return [tasks[:size] for size in sizes]
+
+    def mean_scores(self, evaluate, candidates, tasks):
+        '''
+        Return the mean score of each candidate over `tasks`, passing all
+        (task, params) pairs which have not been scored before to `evaluate`
+        as a single batch.
+        '''
+        units = []
+        pending = set()
+        for candidate in candidates:
+            for task in tasks:
+                key = (tuple(sorted(candidate.items())), task)
+                if key not in self.scores and key not in pending:
+                    pending.add(key)
+                    units.append((task, candidate))
+        if len(units) > 0:
+            for (task, candidate), score in zip(units, evaluate(units)):
+                self.scores[(tuple(sorted(candidate.items())), task)] = score
+        return [np.mean([self.scores[(tuple(sorted(candidate.items())), task)] for task in tasks]) for candidate in candidates]
+
+    def maximise(self, evaluate, tasks):
+        '''
+        Search for the best parameters, returning them as a dictionary.
+        `evaluate` is passed a list of (task, params) pairs, and should return
+        the score of each.
+        '''
+        rng = np.random.RandomState(self.seed)
+        tasks = list(tasks)
+        n = len(self.names)
+
+        population = self.lower + rng.rand(self.popsize, n)*(self.upper - self.lower)
+        fitness = self.mean_scores(evaluate, [self.candidate(x) for x in population], tasks)
+
+        for generation in range(self.generations):
+            trials = np.empty_like(population)
+            for i in range(self.popsize):
+                others = [j for j in range(self.popsize) if j != i]
+                a, b, c = population[rng.choice(others, 3, replace=False)]
+                mutant = np.clip(a + self.mutation*(b - c), self.lower, self.upper)
+                cross = rng.rand(n) < self.crossover
+                cross[rng.randint(n)] = True
+                trials[i] = np.where(cross, mutant, population[i])
+
+            survivors = range(self.popsize)
+            for subset in self.subsets(tasks):
+                candidates = [self.candidate(trials[i]) for i in survivors] + [self.candidate(population[i]) for i in survivors]
+                scores = self.mean_scores(evaluate, candidates, subset)
+                k = len(survivors)
+                improved = dict((i, trial) for i, trial, parent in zip(survivors, scores[:k], scores[k:]) if trial >= parent)
+                survivors = sorted(improved)
+            for i in survivors:
+                population[i] = trials[i]
+                fitness[i] = improved[i] # Scored over all tasks in the last rung
+
+        best = int(np.argmax(fitness))
+        self.best = self.candidate(population[best])
+        self.best_score = fitness[best]
+        return self.best
@@ -0,0 +1,365 @@
+import os
+import sys
+import time
+import math
+import errno
+import signal
+import select
+import resource
+import tempfile
+import threading
+import subprocess
+from collections import deque
+
+
+def _monotonic():
+    try:
+        import ctypes, ctypes.util
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        libc = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'), use_errno=True)
+        clock_gettime = libc.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        CLOCK_MONOTONIC = 1
+
+        def monotonic():
+            t = timespec()
+            if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+                raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+            return t.tv_sec + t.tv_nsec*1e-9
+        monotonic()
+        return monotonic
+    except (OSError, AttributeError, TypeError):
+        return time.time
+
+monotonic = getattr(time, 'monotonic', None) or _monotonic()
+
+
+# Run children through a small process of its own; see ChildProcess.
+_launcher = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'launcher.py')
+
+
+# The process groups of running children, by the thread which started them,
+# so that an executor which is interrupted can kill those of its workers
+# (being in groups of their own, they do not receive the interrupt); and the
+# threads whose children are killed as soon as they start.
+_groups = {}
+_cancelled = set()
+_groups_lock = threading.Lock()
+
+def _kill_group(pgid):
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except OSError, e:
+        if e.errno != errno.ESRCH:
+            raise
+
+def started_group(pgid):
+    ident = threading.current_thread().ident
+    with _groups_lock:
+        _groups.setdefault(ident, set()).add(pgid)
+        cancelled = ident in _cancelled
+    if cancelled:
+        _kill_group(pgid)
+
+def finished_group(pgid):
+    with _groups_lock:
+        for groups in _groups.values():
+            groups.discard(pgid)
+
+def kill_groups(threads):
+    '''
+    Kill the process groups of the children still running which were
+    started by any of `threads`, and of those they start from now on (such
+    as further repeats of a benchmark) until they are forgotten.
+    '''
+    with _groups_lock:
+        _cancelled.update(thread.ident for thread in threads)
+        pgids = [pgid for thread in threads for pgid in _groups.get(thread.ident, ())]
+    for pgid in pgids:
+        _kill_group(pgid)
+
+def forget_threads(threads):
+    # Called once `threads` have finished, since their idents may be reused.
+    with _groups_lock:
+        for thread in threads:
+            _cancelled.discard(thread.ident)
+            _groups.pop(thread.ident, None)
+
+
+class Limits(object):
+    '''
+    Limits on wall time and CPU time (in seconds) and address space (in
+    megabytes); the latter two as rlimits of each process.
+    '''
+
+    def __init__(self, time=None, cpu=None, memory=None):
+        self.time = time
+        self.cpu = cpu
+        self.memory = memory
+
+    def __repr__(self):
+        return "Limits(time=%r, cpu=%r, memory=%r)" % (self.time, self.cpu, self.memory)
+
+    def __nonzero__(self):
+        return self.time is not None or self.cpu is not None or self.memory is not None
+
+    def apply(self):
+        if self.cpu is not None:
+            seconds = int(math.ceil(self.cpu))
+            resource.setrlimit(resource.RLIMIT_CPU, (seconds, seconds+1))
+        if self.memory is not None:
+            size = int(self.memory*1024*1024)
+            resource.setrlimit(resource.RLIMIT_AS, (size, size))
+
+
+class OutputCapture(object):
+    '''
+    An output stream, of which only the first `head` and last `tail` bytes are
+    kept; lines are passed to `parse` as they arrive.
+    '''
+
+    max_line = 65536
+
+    def __init__(self, head=None, tail=None, parse=None, spill=None, prefix='output-', suffix='.log'):
+        self.head = head
+        self.tail = tail
+        self.parse = parse
+        self.metrics = {}
+        self.size = 0
+        self.__head = []
+        self.__head_size = 0
+        self.__tail = deque()
+        self.__tail_size = 0
+        self.__partial = ''
+        self.path = None
+        self.__file = None
+        if spill is not None:
+            if not os.path.exists(spill):
+                os.makedirs(spill)
+            fd, self.path = tempfile.mkstemp(dir=spill, prefix=prefix, suffix=suffix)
+            self.__file = os.fdopen(fd, 'wb')
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.__file is not None:
+            self.__file.write(chunk)
+
+        if self.parse is not None:
+            lines = (self.__partial + chunk).split('\n')
+            self.__partial = lines.pop()
+            if len(self.__partial) > self.max_line:
+                self.__partial = '' # Not a line worth parsing
+            for line in lines:
+                self.__parse(line)
+
+        if self.head is None:
+            self.__head.append(chunk)
+            return
+        if self.__head_size < self.head:
+            part = chunk[:self.head - self.__head_size]
+            self.__head.append(part)
+            self.__head_size += len(part)
+            chunk = chunk[len(part):]
+        if len(chunk) > 0 and (self.tail is None or self.tail > 0):
+            self.__tail.append(chunk)
+            self.__tail_size += len(chunk)
+            while self.tail is not None and self.__tail_size - len(self.__tail[0]) >= self.tail:
+                self.__tail_size -= len(self.__tail.popleft())
+
+    def __parse(self, line):
+        for key, value in self.parse(line):
+            self.metrics[key] = value
+
+    def close(self):
+        if self.parse is not None and self.__partial:
+            self.__parse(self.__partial)
+        self.__partial = ''
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    @property
+    def text(self):
+        head = ''.join(self.__head)
+        tail = ''.join(self.__tail)
+        if self.tail is not None:
+            tail = tail[-self.tail:] if self.tail > 0 else ''
+        omitted = self.size - len(head) - len(tail)
+        if omitted > 0:
+            return head + "\n[... %d bytes omitted ...]\n" % omitted + tail
+        return head + tail
+
+
+class ChildProcess(object):
+    '''
+    A child process in its own process group, whose output is captured and
+    whose resource usage is collected as it is reaped.
+    '''
+
+    def __init__(self, args, limits=None, capture=None, **kwargs):
+        kwargs.setdefault('stdout', subprocess.PIPE)
+        kwargs.setdefault('stderr', subprocess.PIPE)
+        self.limits = limits if limits is not None else Limits()
+
+        preexec_fn = kwargs.pop('preexec_fn', None)
+        def setup():
+            os.setpgid(0, 0)
+            self.limits.apply()
+            if preexec_fn is not None:
+                preexec_fn()
+
+        self.start = monotonic()
+        self.deadline = None
+        if self.limits.time is not None:
+            self.deadline = self.start + self.limits.time
+        self.timed_out = False
+        self.report = None
+        if sys.executable and not kwargs.get('shell'):
+            fd, self.report = tempfile.mkstemp(prefix='relentless-usage-')
+            os.close(fd)
+            args = [sys.executable, '-S', '-E', _launcher, self.report] + ([args] if isinstance(args, basestring) else list(args))
+        try:
+            self.popen = subprocess.Popen(args, preexec_fn=setup, **kwargs)
+        except:
+            self.__remove_report()
+            raise
+        self.pid = self.popen.pid
+        started_group(self.pid)
+        self.output = {}
+        self.streams = {}
+        for name in ('stdout', 'stderr'):
+            stream = getattr(self.popen, name)
+            if stream is not None:
+                self.output[name] = capture(name) if capture is not None else OutputCapture()
+                self.streams[stream.fileno()] = (name, stream)
+        self.returncode = None
+        self.usage = None
+
+    @property
+    def stdout(self):
+        return self.output['stdout'].text if 'stdout' in self.output else ''
+
+    @property
+    def stderr(self):
+        return self.output['stderr'].text if 'stderr' in self.output else ''
+
+    def filenos(self):
+        return self.streams.keys()
+
+    def read(self, fd):
+        '''
+        Read whatever output is available on `fd`, closing it at end of file.
+        '''
+        name, stream = self.streams[fd]
+        try:
+            chunk = os.read(fd, 65536)
+        except OSError, e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            raise
+        if chunk:
+            self.output[name].write(chunk)
+        else:
+            self.output[name].close()
+            stream.close()
+            del self.streams[fd]
+
+    def kill(self):
+        try:
+            os.killpg(self.pid, signal.SIGKILL)
+        except OSError, e:
+            if e.errno != errno.ESRCH:
+                raise
+
+    def expire(self):
+        '''
+        Kill the process group if the wall time limit has passed, returning
+        the number of seconds remaining otherwise (or None if unlimited).
+        '''
+        if self.deadline is None or self.timed_out:
+            return None
+        remaining = self.deadline - monotonic()
+        if remaining <= 0:
+            self.timed_out = True
+            self.kill()
+            return None
+        return remaining
+
+    def reap(self, block=True):
+        '''
+        Collect the exit status and resource usage of the child, returning
+        True if it has exited.
+        '''
+        if self.returncode is not None:
+            return True
+        while True:
+            try:
+                pid, status, rusage = os.wait4(self.pid, 0 if block else os.WNOHANG)
+                break
+            except OSError, e:
+                if e.errno != errno.EINTR:
+                    raise
+        if pid == 0:
+            return False
+        finished_group(self.pid)
+        self.end = monotonic()
+        if os.WIFSIGNALED(status):
+            self.returncode = -os.WTERMSIG(status)
+        else:
+            self.returncode = os.WEXITSTATUS(status)
+        self.popen.returncode = self.returncode # Stop Popen from trying to reap the child itself.
+        self.usage = {
+            'wall_time': self.end - self.start,
+            'cpu_user': rusage.ru_utime,
+            'cpu_system': rusage.ru_stime,
+            'cpu_time': rusage.ru_utime + rusage.ru_stime,
+            'max_rss': rusage.ru_maxrss,
+        }
+        if self.report is not None:
+            try:
+                with open(self.report) as f:
+                    wall_time, cpu_user, cpu_system, max_rss = f.read().split()
+                self.usage.update({
+                    'wall_time': float(wall_time),
+                    'cpu_user': float(cpu_user),
+                    'cpu_system': float(cpu_system),
+                    'cpu_time': float(cpu_user) + float(cpu_system),
+                    'max_rss': int(max_rss),
+                })
+            except (IOError, ValueError):
+                pass # The launcher was killed too (such as at the time limit).
+            self.__remove_report()
+        return True
+
+    def __remove_report(self):
+        try:
+            os.remove(self.report)
+        except OSError:
+            pass
+        self.report = None
+
+    def communicate(self):
+        '''
+        Wait for the child to exit, collecting its output; returning the
+        output of stdout and stderr.
+        '''
+        try:
+            while len(self.streams) > 0:
+                try:
+                    ready, _, _ = select.select(self.filenos(), [], [], self.expire())
+                except select.error, e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                for fd in ready:
+                    self.read(fd)
+            while not self.reap(block=self.deadline is None or self.timed_out):
+                time.sleep(min(0.01, self.expire() or 0.01))
+        except:
+            self.kill()
+            self.reap()
+            raise
+        return self.stdout, self.stderr
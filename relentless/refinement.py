@@ -0,0 +1,106 @@
+import itertools
+
+import numpy as np
+
+
+class GridRefinement(object):
+    '''
+    An adaptive sampling of a grid of `shape`, halving the cells whose corners
+    differ most, and interpolating the rest.
+    '''
+
+    def __init__(self, shape, coarse=2):
+        self.shape = tuple(shape)
+        self.coarse = coarse
+        self.cells = [(tuple(0 for n in self.shape), tuple(n - 1 for n in self.shape))]
+        self.values = {} # index -> value
+
+    @staticmethod
+    def corners(cell):
+        lo, hi = cell
+        return list(itertools.product(*[sorted(set(bounds)) for bounds in zip(lo, hi)]))
+
+    @staticmethod
+    def splittable(cell):
+        lo, hi = cell
+        return any(h - l > 1 for l, h in zip(lo, hi))
+
+    @staticmethod
+    def split(cell):
+        lo, hi = cell
+        halves = []
+        for l, h in zip(lo, hi):
+            if h - l > 1:
+                m = (l + h)//2
+                halves.append([(l, m), (m, h)])
+            else:
+                halves.append([(l, h)])
+        return [tuple(zip(*bounds)) for bounds in itertools.product(*halves)]
+
+    def spread(self, cell):
+        values = [self.values[corner] for corner in self.corners(cell)]
+        return max(values) - min(values)
+
+    def sample(self, evaluate, budget):
+        '''
+        Sample at most `budget` points (enough for the corners of the grid).
+        '''
+        corners = self.corners(self.cells[0])
+        if budget < len(corners):
+            raise ValueError("A budget of %d points cannot cover the %d corners of the grid." % (budget, len(corners)))
+        self.__evaluate(evaluate, corners, budget)
+        rounds = 0
+        while len(self.values) < budget:
+            candidates = [cell for cell in self.cells if self.splittable(cell)]
+            if rounds < self.coarse:
+                chosen = candidates
+            else:
+                candidates = [cell for cell in candidates if self.spread(cell) > 0]
+                candidates.sort(key=self.spread, reverse=True)
+                chosen = candidates[:max(1, len(candidates)//4)]
+
+            # Split as many of the chosen cells as the budget allows.
+            children = {}
+            needed = set()
+            for cell in chosen:
+                split = self.split(cell)
+                new = set(corner for child in split for corner in self.corners(child) if corner not in self.values) - needed
+                if len(self.values) + len(needed) + len(new) > budget:
+                    break
+                children[cell] = split
+                needed.update(new)
+            if len(children) == 0:
+                break
+
+            self.__evaluate(evaluate, sorted(needed), budget)
+            self.cells = [child for cell in self.cells for child in children.get(cell, [cell])]
+            rounds += 1
+        return self.values
+
+    def __evaluate(self, evaluate, indices, budget):
+        indices = [index for index in indices if index not in self.values][:budget - len(self.values)]
+        if len(indices) > 0:
+            self.values.update(zip(indices, evaluate(indices)))
+
+    def interpolate(self):
+        '''
+        Return the map over the whole grid, interpolating (multilinearly) from
+        the corners of the cell containing each point which was not sampled.
+        '''
+        result = np.full(self.shape, np.nan)
+        for cell in self.cells:
+            lo, hi = cell
+            if any(corner not in self.values for corner in self.corners(cell)):
+                continue
+            for index in itertools.product(*[range(l, h + 1) for l, h in zip(lo, hi)]):
+                t = [float(i - l)/(h - l) if h > l else 0. for i, l, h in zip(index, lo, hi)]
+                value = 0.
+                for corner in itertools.product(*[(0, 1) if h > l else (0,) for l, h in zip(lo, hi)]):
+                    weight = 1.
+                    for c, ti in zip(corner, t):
+                        weight *= ti if c else 1 - ti
+                    value += weight*self.values[tuple(h if c else l for c, l, h in zip(corner, lo, hi))]
+                result[index] = value
+        for index, value in self.values.items():
+            result[index] = value
+        return result
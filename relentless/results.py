@@ -0,0 +1,147 @@
+import numpy as np
+
+from .computations import ComputationResult
+
+
+class ResultSet(object):
+    '''
+    The results of an iteration, stored column by column: numeric fields as
+    float arrays (NaN where missing), others as object arrays.
+    '''
+
+    text_fields = ['stdout', 'stderr', 'status', 'stdout_log', 'stderr_log']
+
+    def __init__(self, shape, columns=None, objects=None):
+        self.shape = tuple(shape)
+        self.columns = columns if columns is not None else {}
+        self.objects = objects if objects is not None else {}
+
+    @classmethod
+    def from_results(cls, results):
+        results = np.asarray(results, dtype=object)
+        rs = cls(results.shape)
+        for index in np.ndindex(*results.shape):
+            if results[index] is not None:
+                rs[index] = results[index]
+        return rs
+
+    @property
+    def fields(self):
+        return sorted(self.columns.keys() + self.objects.keys())
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __setitem__(self, index, result):
+        self.__column('score')[index] = result.score # Accounts for the status of the run
+        for key, value in result.info.items():
+            if key == 'score':
+                continue
+            if key not in self.objects and key not in self.text_fields and isinstance(value, (int, long, float, basestring, np.number)) and not isinstance(value, bool):
+                try:
+                    self.__column(key)[index] = float(value)
+                    continue
+                except ValueError:
+                    pass
+            self.__objects(key)[index] = value
+
+    def __column(self, key):
+        if key not in self.columns:
+            self.columns[key] = np.full(self.shape, np.nan)
+        return self.columns[key]
+
+    def __objects(self, key):
+        if key not in self.objects:
+            self.objects[key] = np.empty(self.shape, dtype=object)
+            if key in self.columns:
+                # Fields which are not always numeric are kept as objects
+                column = self.columns.pop(key)
+                present = ~np.isnan(column)
+                self.objects[key][present] = column[present]
+        return self.objects[key]
+
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index,)
+        if len(index) == len(self.shape) and all(isinstance(i, (int, long, np.integer)) for i in index):
+            return self.result(index)
+        columns = dict((key, column[index]) for key, column in self.columns.items())
+        objects = dict((key, values[index]) for key, values in self.objects.items())
+        shape = columns.values()[0].shape if len(columns) > 0 else np.empty(self.shape)[index].shape
+        return ResultSet(shape, columns, objects)
+
+    def result(self, index):
+        info = {}
+        for key, column in self.columns.items():
+            if not np.isnan(column[index]):
+                info[key] = float(column[index])
+        for key, values in self.objects.items():
+            if values[index] is not None:
+                info[key] = values[index]
+        if len(info) == 0:
+            return None
+        for key in ('task', 'returncode', 'cpu'):
+            if key in info and isinstance(info[key], float):
+                info[key] = int(info[key])
+        result = ComputationResult(info.get('task'), info.get('params', {}), info.get('stdout', ''), info.get('stderr', ''), info.get('runtime'))
+        result(**info)
+        return result
+
+    def __iter__(self):
+        for i in range(self.shape[0]):
+            yield self[i]
+
+    def flatten(self):
+        return [self.result(index) for index in np.ndindex(*self.shape)]
+
+    def field(self, name):
+        '''
+        Return the values of field `name` as an array with the shape of this
+        result set; a float64 view for numeric fields, and an object array
+        otherwise.
+        '''
+        if name in self.columns:
+            return self.columns[name]
+        if name in self.objects:
+            return self.objects[name]
+        raise KeyError("No results have a field named '%s'." % name)
+
+    @property
+    def done(self):
+        '''
+        The number of points holding a result, as a ResultSet being filled
+        (such as by `Tester.stream`) may not yet hold one at every point.
+        '''
+        if 'score' not in self.columns:
+            return 0
+        return int(np.sum(~np.isnan(self.columns['score'])))
+
+    def sum(self, name, axis=None, skipna=False):
+        return (np.nansum if skipna else np.sum)(self.field(name), axis=axis)
+
+    def mean(self, name, axis=None, skipna=False):
+        return (np.nanmean if skipna else np.mean)(self.field(name), axis=axis)
+
+    def to_npz(self, path, compressed=False):
+        '''
+        Save the numeric columns to `path` as a NumPy archive, with one array
+        per field. Output and other non-numeric fields are not saved.
+        '''
+        (np.savez_compressed if compressed else np.savez)(path, **self.columns)
+
+    def to_arrow(self):
+        '''
+        Return a pyarrow Table with one row per result and one column per
+        numeric field (plus the index along each dimension). The columns
+        share memory with this result set where pyarrow allows.
+        '''
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError("Exporting results to Arrow requires pyarrow to be installed.")
+        arrays = {}
+        for axis, indices in enumerate(np.indices(self.shape)):
+            arrays['index_%d' % axis] = pyarrow.array(indices.ravel())
+        for key, column in self.columns.items():
+            arrays[key] = pyarrow.array(np.ascontiguousarray(column).ravel())
+        return pyarrow.Table.from_arrays(arrays.values(), names=arrays.keys())
@@ -0,0 +1,328 @@
+import sys
+import errno
+import heapq
+import select
+import itertools
+import threading
+import Queue
+from multiprocessing import cpu_count
+
+from .process import monotonic, kill_groups, forget_threads
+
+
+def resolve_nprocs(nprocs):
+    # None means every CPU, and a negative number all but that many.
+    if nprocs is None:
+        nprocs = cpu_count()
+    elif nprocs < 0:
+        nprocs = cpu_count() + nprocs
+    return max(1, nprocs)
+
+
+class WorkGroup(object):
+    '''
+    The units of one computation, which is made by `build`; `built` returns its
+    digest. `source` identifies what it is built from, if not its name.
+    '''
+
+    def __init__(self, name, units, build, digest=None, built=None, release=None, priority=None, source=None):
+        self.name = name
+        self.units = list(units)
+        self.build = build
+        self.digest = digest
+        self.built = built if built is not None else lambda computation: computation.digest()
+        self.release = release if release is not None else lambda computation: None
+        self.priority = priority
+        self.source = source
+
+
+class RuntimeHistory(object):
+    '''
+    Mean runtimes of units (and tasks), so that the longest units can be
+    started first; stored row by row.
+    '''
+
+    window = 10 # Later runtimes are averaged over roughly this many runs
+
+    def __init__(self):
+        self.runtimes = {} # (task, params) -> (mean runtime, runs)
+        self.tasks = {} # task -> (mean runtime, runs), over all params
+        self.__total = 0. # Of the means of the units in `runtimes`
+        self.__loaded = set()
+        self.__changed = set()
+
+    @classmethod
+    def update(cls, row, runtime):
+        mean, runs = row if row is not None else (0., 0)
+        return (mean + (runtime - mean)/float(min(runs + 1, cls.window)), runs + 1)
+
+    def loaded(self, key):
+        return key in self.__loaded
+
+    def load(self, key, row):
+        '''
+        Add the stored `row` (or None, if there is none) for `key`, unless
+        the row is already known.
+        '''
+        self.__loaded.add(key)
+        if row is None:
+            return
+        if isinstance(key, tuple):
+            if key not in self.runtimes:
+                self.__set(key, row)
+        elif key not in self.tasks:
+            self.tasks[key] = row
+
+    def __set(self, key, row):
+        self.__total += row[0] - self.runtimes.get(key, (0., 0))[0]
+        self.runtimes[key] = row
+
+    def record(self, task, params, runtime):
+        key = (task, params)
+        self.__set(key, self.update(self.runtimes.get(key), runtime))
+        self.tasks[task] = self.update(self.tasks.get(task), runtime)
+        self.__changed.update([key, task])
+
+    def changed(self):
+        '''
+        Return the (key, row) pairs changed since the last call.
+        '''
+        rows = [(key, self.runtimes[key] if isinstance(key, tuple) else self.tasks[key]) for key in self.__changed]
+        self.__changed = set()
+        return rows
+
+    def expected(self, task, params):
+        if (task, params) in self.runtimes:
+            return self.runtimes[(task, params)][0]
+        if task in self.tasks:
+            return self.tasks[task][0]
+        if len(self.runtimes) > 0:
+            return self.__total/len(self.runtimes)
+        return 0.
+
+
+class Makespan(object):
+    '''
+    The time from the start of the first unit to the end of the last, against
+    a lower bound on it: the larger of the longest unit and the total runtime
+    of the units spread evenly over `nprocs` processes.
+    '''
+
+    def __init__(self, nprocs=None):
+        self.nprocs = nprocs
+        self.start = None
+        self.end = None
+        self.total = 0.
+        self.longest = 0.
+        self.units = 0
+
+    def started(self):
+        # Called by the executor as each unit starts to run.
+        now = monotonic()
+        if self.start is None or now < self.start:
+            self.start = now
+
+    def finished(self, runtime):
+        self.end = monotonic()
+        self.total += runtime
+        self.longest = max(self.longest, runtime)
+        self.units += 1
+
+    @property
+    def makespan(self):
+        return self.end - self.start if self.end is not None else 0.
+
+    @property
+    def lower_bound(self):
+        if self.nprocs is None:
+            return self.longest
+        return max(self.longest, self.total/self.nprocs)
+
+    def __str__(self):
+        return "Makespan: %.2fs for %d units on %s processes | Lower bound: %.2fs | Efficiency: %.3f" % (self.makespan, self.units, self.nprocs or '?', self.lower_bound, self.lower_bound/self.makespan if self.makespan > 0 else 1.)
+
+
+class Scheduler(object):
+    '''
+    A pool of worker and builder threads, which run units (lowest priority
+    first) with `execute`; results are collected with `next_event`.
+    '''
+
+    def __init__(self, nprocs=None, builders=1, execute=None, started=None):
+        self.nprocs = resolve_nprocs(nprocs)
+        self.builders = max(1, builders)
+        self.execute = execute if execute is not None else lambda computation, task, params: computation.run(task, params=params)
+        self.started = started
+        self.__builds = Queue.Queue()
+        self.__runs = Queue.PriorityQueue()
+        self.__events = Queue.Queue()
+        self.__counter = itertools.count()
+        self.__outstanding = 0
+        self.__threads = []
+
+    def build(self, group, build):
+        self.__outstanding += 1
+        self.__builds.put((group, build))
+
+    def run(self, group, computation, task, params={}, priority=0):
+        self.__outstanding += 1
+        self.__runs.put((priority, next(self.__counter), group, computation, task, params))
+
+    @property
+    def outstanding(self):
+        return self.__outstanding
+
+    def next_event(self):
+        if self.__outstanding == 0:
+            raise RuntimeError("No work is outstanding.")
+        self.__start()
+        while True:
+            try:
+                event = self.__events.get(timeout=1) # A timeout keeps the wait interruptible.
+                break
+            except Queue.Empty:
+                pass
+        self.__outstanding -= 1
+        if event[0] == 'error':
+            exc = event[2]
+            raise exc[0], exc[1], exc[2]
+        return event
+
+    def close(self):
+        # Discard any units which have not yet started.
+        while True:
+            try:
+                self.__runs.get_nowait()
+            except Queue.Empty:
+                break
+        if self.__outstanding > 0:
+            # Closed early (such as on an interrupt), so kill the units still
+            # running, which would not otherwise see the interrupt.
+            kill_groups([thread for thread in self.__threads if thread.name.startswith('worker')])
+        for thread in self.__threads:
+            if thread.name.startswith('builder'):
+                self.__builds.put(None)
+            else:
+                self.__runs.put((float('inf'), None, None, None, None, None))
+        for thread in self.__threads:
+            thread.join()
+        forget_threads(self.__threads)
+        self.__threads = []
+
+    def __start(self):
+        if len(self.__threads) > 0:
+            return
+        for i in range(self.builders):
+            self.__threads.append(threading.Thread(target=self.__builder, name='builder-%d' % i))
+        for i in range(self.nprocs):
+            self.__threads.append(threading.Thread(target=self.__worker, name='worker-%d' % i))
+        for thread in self.__threads:
+            thread.daemon = True
+            thread.start()
+
+    def __builder(self):
+        while True:
+            item = self.__builds.get()
+            if item is None:
+                break
+            group, build = item
+            try:
+                self.__events.put(('built', group, build()))
+            except:
+                self.__events.put(('error', group, sys.exc_info()))
+
+    def __worker(self):
+        while True:
+            _, _, group, computation, task, params = self.__runs.get()
+            if computation is None:
+                break
+            try:
+                if self.started is not None:
+                    self.started()
+                self.__events.put(('result', group, (task, params), self.execute(computation, task, params=params)))
+            except:
+                self.__events.put(('error', group, sys.exc_info()))
+
+
+class EventLoop(object):
+    '''
+    A Scheduler which drives `nprocs` child processes from a single thread.
+    '''
+
+    def __init__(self, nprocs=None, builders=1, execute=None, started=None):
+        if execute is not None:
+            raise ValueError("The event loop cannot run units through a custom execute function.")
+        self.nprocs = resolve_nprocs(nprocs)
+        self.__builds = []
+        self.__runs = []
+        self.__counter = itertools.count()
+        self.__running = []
+        self.__fds = {}
+        self.__poll = select.poll()
+        self.__outstanding = 0
+        self.started = started
+
+    def build(self, group, build):
+        self.__outstanding += 1
+        self.__builds.append((group, build))
+
+    def run(self, group, computation, task, params={}, priority=0):
+        self.__outstanding += 1
+        heapq.heappush(self.__runs, (priority, next(self.__counter), group, computation, task, params))
+
+    @property
+    def outstanding(self):
+        return self.__outstanding
+
+    def next_event(self):
+        if self.__outstanding == 0:
+            raise RuntimeError("No work is outstanding.")
+        if len(self.__builds) > 0:
+            group, build = self.__builds.pop(0)
+            self.__outstanding -= 1
+            return ('built', group, build())
+        while True:
+            while len(self.__running) < self.nprocs and len(self.__runs) > 0:
+                _, _, group, computation, task, params = heapq.heappop(self.__runs)
+                process = computation.start(task, params=params)
+                if self.started is not None:
+                    self.started()
+                self.__running.append((group, computation, process))
+                for fd in process.filenos():
+                    self.__fds[fd] = process
+                    self.__poll.register(fd, select.POLLIN | select.POLLHUP | select.POLLERR)
+
+            for i, (group, computation, process) in enumerate(self.__running):
+                process.expire()
+                if len(process.streams) == 0 and process.reap(block=False):
+                    del self.__running[i]
+                    self.__outstanding -= 1
+                    return ('result', group, (process.task, process.params), computation.finish(process))
+
+            # Wake up for output, for the next deadline, or shortly to reap
+            # children whose output has already closed.
+            timeouts = [process.expire() for _, _, process in self.__running]
+            timeouts = [t for t in timeouts if t is not None]
+            if any(len(process.streams) == 0 for _, _, process in self.__running):
+                timeouts.append(0.001)
+            timeout = int(min(timeouts)*1000) + 1 if len(timeouts) > 0 else None
+            try:
+                events = self.__poll.poll(timeout)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd, event in events:
+                process = self.__fds[fd]
+                process.read(fd)
+                if fd not in process.streams:
+                    self.__poll.unregister(fd)
+                    del self.__fds[fd]
+
+    def close(self):
+        self.__runs = []
+        for group, computation, process in self.__running:
+            process.kill()
+            process.reap()
+            computation.release(process)
+        self.__running = []
@@ -0,0 +1,153 @@
+import math
+
+
+def median(xs):
+    xs = sorted(xs)
+    n = len(xs)
+    if n == 0:
+        raise ValueError("Cannot take the median of no samples.")
+    if n % 2 == 1:
+        return float(xs[n//2])
+    return (xs[n//2-1] + xs[n//2])/2.
+
+def mad(xs):
+    '''
+    The median absolute deviation of the samples from their median.
+    '''
+    m = median(xs)
+    return median([abs(x - m) for x in xs])
+
+def normal_quantile(p):
+    '''
+    The quantile function of the standard normal distribution, found by
+    bisection of its cumulative distribution function.
+    '''
+    if not 0 < p < 1:
+        raise ValueError("p must lie strictly between 0 and 1.")
+    lo, hi = -40., 40.
+    for _ in range(200):
+        mid = (lo + hi)/2
+        if 0.5*(1 + math.erf(mid/math.sqrt(2))) < p:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi)/2
+
+def median_ci(xs, confidence=0.95):
+    '''
+    A distribution-free confidence interval for the median of the population
+    from which `xs` were drawn, taken between order statistics of the samples.
+    With too few samples this is simply their range.
+    '''
+    xs = sorted(xs)
+    n = len(xs)
+    z = normal_quantile(0.5 + confidence/2)
+    lower = int(math.floor(n/2. - z*math.sqrt(n)/2))
+    upper = int(math.ceil(n/2. + z*math.sqrt(n)/2))
+    return float(xs[max(lower, 1) - 1]), float(xs[min(upper, n) - 1])
+
+def summarise(xs, confidence=0.95):
+    lo, hi = median_ci(xs, confidence)
+    return {'n': len(xs), 'median': median(xs), 'mad': mad(xs), 'ci': (lo, hi)}
+
+
+class Benchmark(object):
+    '''
+    A plan for repeating a task until the CI of the median of `metric` is
+    narrower than `ci_width`.
+    '''
+
+    fields = ['runtime', 'wall_time', 'cpu_time', 'cpu_user', 'cpu_system', 'max_rss']
+
+    def __init__(self, metric='cpu_time', warmup=1, min_runs=5, max_runs=30, ci_width=0.05, confidence=0.95):
+        if min_runs < 1 or max_runs < min_runs:
+            raise ValueError("Need 1 <= min_runs <= max_runs.")
+        self.metric = metric
+        self.warmup = warmup
+        self.min_runs = min_runs
+        self.max_runs = max_runs
+        self.ci_width = ci_width
+        self.confidence = confidence
+
+    def __repr__(self):
+        return "Benchmark(metric=%r, warmup=%r, min_runs=%r, max_runs=%r, ci_width=%r, confidence=%r)" % (self.metric, self.warmup, self.min_runs, self.max_runs, self.ci_width, self.confidence)
+
+    def converged(self, xs):
+        if len(xs) < self.min_runs:
+            return False
+        lo, hi = median_ci(xs, self.confidence)
+        m = median(xs)
+        if m == 0:
+            return hi - lo == 0
+        return (hi - lo)/abs(m) <= self.ci_width
+
+    def measure(self, run):
+        '''
+        The first result of `run`, with its timings replaced by their medians.
+        '''
+        for i in range(self.warmup):
+            result = run()
+            if result.status != 'OK':
+                return result
+
+        results = []
+        while len(results) < self.max_runs:
+            results.append(run())
+            if results[-1].status != 'OK':
+                return results[-1]
+            if self.converged([float(getattr(r, self.metric)) for r in results]):
+                break
+
+        result = results[0]
+        samples = {}
+        stats = {}
+        for field in self.fields:
+            if field in result.info:
+                samples[field] = [float(r.info[field]) for r in results]
+                stats[field] = summarise(samples[field], self.confidence)
+                result.info[field] = stats[field]['median']
+        result(samples=samples, stats=stats, repeats=len(results))
+        return result
+
+
+def likelihood_of_superiority(wins, losses):
+    '''
+    The probability that the true win rate exceeds the loss rate, given
+    `wins` and `losses` (ties not counted), in the normal approximation.
+    '''
+    if wins + losses == 0:
+        return 0.5
+    return 0.5*(1 + math.erf((wins - losses)/math.sqrt(2.*(wins + losses))))
+
+
+class SignTest(object):
+    '''
+    A sequential probability ratio test on the signs of paired differences.
+    '''
+
+    def __init__(self, alpha=0.05, beta=0.05, delta=0.1):
+        if not 0 < delta < 0.5:
+            raise ValueError("delta must lie strictly between 0 and 0.5.")
+        self.alpha = alpha
+        self.beta = beta
+        self.delta = delta
+        self.lower = math.log(beta/(1 - alpha))
+        self.upper = math.log((1 - beta)/alpha)
+
+    def __repr__(self):
+        return "SignTest(alpha=%r, beta=%r, delta=%r)" % (self.alpha, self.beta, self.delta)
+
+    def llr(self, wins, losses):
+        return (wins - losses)*math.log((0.5 + self.delta)/(0.5 - self.delta))
+
+    def decide(self, wins, losses):
+        '''
+        Return 1 if the new version is better, -1 if it is worse, and 0 if
+        more pairs are needed to tell.
+        '''
+        llr = self.llr(wins, losses)
+        if llr >= self.upper:
+            return 1
+        if llr <= self.lower:
+            return -1
+        return 0
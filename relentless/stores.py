@@ -0,0 +1,112 @@
+import os
+import shelve
+import sqlite3
+import threading
+import cPickle as pickle
+
+
+class ResultStore(object):
+    '''
+    A persistent mapping from cache keys to results. Backends need only
+    implement `get` and `put_many`; writes are handed over in batches so
+    that backends can commit them in a single transaction.
+    '''
+
+    extension = None
+
+    def __init__(self, path, **kwargs):
+        self.path = path
+        self.init(**kwargs)
+
+    def init(self):
+        pass
+
+    def get(self, key, default=None):
+        raise NotImplementedError()
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def put_many(self, items):
+        raise NotImplementedError()
+
+    def missing(self, keys):
+        '''
+        Return those of `keys` which are not present in the store.
+        '''
+        return [key for key in keys if self.get(key) is None]
+
+    def close(self):
+        pass
+
+
+class ShelveStore(ResultStore):
+
+    extension = 'cache'
+
+    def init(self):
+        self.__shelf = shelve.open(self.path)
+
+    def get(self, key, default=None):
+        return self.__shelf.get(key, default)
+
+    def put_many(self, items):
+        for key, value in items:
+            self.__shelf[key] = value
+        self.__shelf.sync()
+
+    def close(self):
+        self.__shelf.close()
+
+
+class SQLiteStore(ResultStore):
+    '''
+    A result store in SQLite (in WAL mode), with a connection per thread.
+    '''
+
+    extension = 'sqlite'
+    chunk_size = 500 # Stay well below SQLite's limit on bound variables.
+
+    def init(self, timeout=60):
+        self.timeout = timeout
+        self.__local = threading.local()
+        self.__connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB)")
+        self.__connection.commit()
+
+    @property
+    def __connection(self):
+        if getattr(self.__local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            connection.text_factory = str
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.__local.connection = connection
+            self.__local.pid = os.getpid()
+        return self.__local.connection
+
+    def get(self, key, default=None):
+        row = self.__connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return default
+        return pickle.loads(str(row[0]))
+
+    def put_many(self, items):
+        rows = [(key, sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))) for key, value in items]
+        if len(rows) == 0:
+            return
+        with self.__connection:
+            self.__connection.executemany("INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)", rows)
+
+    def missing(self, keys):
+        keys = list(keys)
+        present = set()
+        for i in range(0, len(keys), self.chunk_size):
+            chunk = keys[i:i+self.chunk_size]
+            query = "SELECT key FROM results WHERE key IN (%s)" % ','.join('?'*len(chunk))
+            present.update(row[0] for row in self.__connection.execute(query, chunk))
+        return [key for key in keys if key not in present]
+
+    def close(self):
+        if getattr(self.__local, 'pid', None) == os.getpid():
+            self.__local.connection.close()
+            self.__local.pid = None
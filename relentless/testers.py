@@ -1,22 +1,37 @@
 import subprocess
 
-import scipy.optimize as spo
+import sys, os, re, time, shelve, hashlib
 
-import sys, os, re, time, git, shelve, shutil
-
-import parampy, numpy as np
+import numpy as np
 
 from .computations import *
+from .stores import *
+from .worktrees import *
+from .artifacts import *
+from .scheduler import *
+from .cluster import Coordinator
+from .affinity import CorePool
+from .statistics import Benchmark, SignTest, likelihood_of_superiority
+from .results import ResultSet
+from .optimisers import DifferentialEvolution
+from .refinement import GridRefinement
+from .journal import Journal
+from .jobserver import Jobserver
+from .fixtures import generator_identity
+from . import tracing
 
 from Queue import Empty as QueueEmpty
 from multiprocessing import Lock, Pipe, Queue as Queue, current_process
 
-import tempfile
+# Plotting (matplotlib and mplstyles), optimisation (scipy), parameter ranges
+# (parampy) and git support (GitPython) are slow to import, and so are only
+# imported by the code which uses them.
+
 
-import matplotlib
-matplotlib.use('agg')
-import matplotlib.pyplot as plt
-from mplstyles import SampleStyle, contour_image
+def canonical_params(params):
+    # Parameters reach the computation as strings in its environment, so two
+    # parameter sets are equivalent exactly when their string forms agree.
+    return sorted((str(key), str(value)) for key, value in params.items())
 
 
 class Tester(object):
@@ -28,7 +43,15 @@ class Tester(object):
         'MarathonComputation': MarathonComputation
     }
 
-    def __init__(self, project, computation_type=None, computation_wrapper=None, computation_wrapper_vis=None, working_dir='_relentless', cache=True, auto_profile=True, **kwargs):
+    result_stores = {
+        'sqlite': SQLiteStore,
+        'shelve': ShelveStore
+    }
+
+    cache_batch = 100 # Maximum number of results held back before writing them to the store
+    cache_interval = 2. # Maximum number of seconds results are held back
+
+    def __init__(self, project, computation_type=None, computation_wrapper=None, computation_wrapper_vis=None, working_dir='_relentless', cache=True, auto_profile=True, cache_backend=None, time_limit=None, cpu_limit=None, memory_limit=None, pin_cores=None, reserve_siblings=False, benchmark=None, output_limit=256*1024, log_dir=None, computation_harness=None, fixture_generator=None, build_jobs=None, **kwargs):
         self.project = os.path.basename(project)
         self.project_dir = os.path.abspath(os.path.dirname(project))
         self.working_dir = working_dir
@@ -52,11 +75,40 @@ class Tester(object):
 
         self.__set_attribute('computation_wrapper',computation_wrapper)
         self.__set_attribute('computation_wrapper_vis',computation_wrapper_vis)
+        self.__set_attribute('computation_harness',computation_harness)
+        self.__set_attribute('fixture_generator',fixture_generator)
+        self.__set_attribute('build_jobs',build_jobs)
+        if self.computation_harness is not None and self.fixture_generator is not None:
+            # A harness is handed only the task, and so would never see its input.
+            raise ValueError("Generated inputs cannot be given to tasks run by a harness.")
+        self.__set_attribute('time_limit',time_limit)
+        self.__set_attribute('cpu_limit',cpu_limit)
+        self.__set_attribute('memory_limit',memory_limit)
+
+        self.__set_attribute('cache_backend', cache_backend, default='sqlite')
+        if self.cache_backend not in self.result_stores:
+            raise ValueError("Invalid cache backend: %s" % self.cache_backend)
 
         self.__use_cache = cache
 
+        # Dedicate a CPU to each run, for timings undisturbed by parallel runs
+        self.cores = None
+        if pin_cores is not None:
+            self.cores = CorePool(pin_cores, reserve_siblings=reserve_siblings)
+
+        # Builds running at once (such as those of compared refs) share a
+        # budget of `build_jobs` make jobs between them.
+        self.jobserver = None
+        if self.build_jobs is not None:
+            self.jobserver = Jobserver(self.build_jobs)
+
+        # If not None, a Benchmark according to which every task is repeated
+        self.benchmark = benchmark
+
+        self.output_limit = output_limit
+        self.log_dir = log_dir
+
         self.lock = Lock()
-        self.p = parampy.Parameters()
 
         self.__kwargs = kwargs
 
@@ -64,47 +116,161 @@ class Tester(object):
 
         self.save_config()
 
-        self.__cache = shelve.open(self.path('tester_cache.cache'))
+        store = self.result_stores[self.cache_backend]
+        self.__store = store(self.path('tester_cache.%s' % store.extension))
+        self.__pending = {}
+        self.__last_sync = time.time()
         self.cache_queue = Queue()
 
+        self.__runtimes = None
+        self.makespans = [] # The Makespan of each call to evaluate
+
+
+    @property
+    def caching(self):
+        return self.__use_cache
+
+    @property
+    def p(self):
+        if getattr(self, '_p', None) is None:
+            import parampy
+            self._p = parampy.Parameters()
+        return self._p
 
     def path(self, filename):
         return os.path.join(self.project_dir, self.working_dir, filename)
 
     def init(self):
-        self.__use_cache = False # Cache does not make sense outside of a git repository where things can remain the same.
+        pass
 
     def cache(self, value=None, task=0, params={}):
-        if not self.__use_cache or len(params) > 0 or task==0:
+        if not self.__use_cache:
             return value
 
         try:
             key = self.get_cache_key(task=task, params=params)
             if value is None:
-                return self.__cache.get(key,None)
+                return self.cache_get(key)
             else:
-                if current_process().name == "MainProcess":
-                    self.__cache[key] = value
-                    self.__cache.sync()
-                else:
-                    self.cache_queue.put([key, value])
-                return value
+                return self.cache_put(key, value)
         except ValueError:
             return value
         except Exception, e:
             raise e
 
-    def cache_sync(self):
+    def cache_get(self, key):
+        if key in self.__pending:
+            return self.__pending[key]
+        with tracing.span('cache get'):
+            return self.__store.get(key,None)
+
+    def cache_put(self, key, value):
+        if current_process().name == "MainProcess":
+            self.__pending[key] = value
+            self.cache_sync()
+        else:
+            self.cache_queue.put([key, value])
+        return value
+
+    @property
+    def runtimes(self):
+        '''
+        The RuntimeHistory of this tester's units, whose rows are kept in the
+        cache (for every ref and set of params) so that it carries over
+        between runs.
+        '''
+        if self.__runtimes is None:
+            self.__runtimes = RuntimeHistory()
+        return self.__runtimes
+
+    def __runtime_key(self, prefix, key):
+        return '%s_%s' % (prefix, hashlib.sha1(repr(key)).hexdigest())
+
+    def load_runtimes(self, units):
+        # Fetch the stored rows of the runtime history which `units` need.
+        if not self.__use_cache:
+            return
+        prefix = 'runtime_%s' % self.get_config_key()
+        runtimes = self.runtimes
+        for task, params in units:
+            unit = (int(task), tuple(canonical_params(params)))
+            for key in (unit, unit[0]):
+                if not runtimes.loaded(key):
+                    runtimes.load(key, self.cache_get(self.__runtime_key(prefix, key)))
+
+    def save_runtimes(self):
+        if self.__use_cache and self.__runtimes is not None:
+            prefix = 'runtime_%s' % self.get_config_key()
+            for key, row in self.__runtimes.changed():
+                self.cache_put(self.__runtime_key(prefix, key), row)
+
+    def cache_missing(self, keys):
+        with tracing.span('cache missing', keys=len(keys)):
+            return self.__store.missing([key for key in keys if key not in self.__pending])
+
+    def cache_sync(self, force=False):
+        '''
+        Collect results from worker processes, and write out those held back
+        in a single batch once enough have accumulated (or when `force` is True).
+        '''
         while True:
             try:
                 r = self.cache_queue.get_nowait()
-                self.__cache[r[0]] = r[1]
+                self.__pending[r[0]] = r[1]
             except QueueEmpty:
                 break
-        self.__cache.sync()
-
-    def get_cache_key(self, task=0, params={}):
-        return str(task)
+        if len(self.__pending) == 0:
+            return
+        if force or len(self.__pending) >= self.cache_batch or time.time() - self.__last_sync > self.cache_interval:
+            with tracing.span('cache sync', results=len(self.__pending)):
+                self.__store.put_many(self.__pending.items())
+            self.__pending = {}
+            self.__last_sync = time.time()
+
+    def get_cache_key(self, task=0, params={}, digest=None):
+        '''
+        Results are keyed by the digest of the built artifact (which covers the
+        wrapper command), the task and the canonical form of the parameters;
+        so that identical binaries share results however they were obtained.
+        '''
+        if digest is None:
+            digest = self.get_digest()
+        key = (digest, int(task), canonical_params(params))
+        if self.benchmark is not None:
+            key += (repr(self.benchmark),)
+        return hashlib.sha1(repr(key)).hexdigest()
+
+    def get_digest(self):
+        return self.computation.digest()
+
+    def get_config_key(self):
+        return hashlib.sha1(repr((self.computation_type.__name__, sorted(self.computation_kwargs().items())))).hexdigest()
+
+    def computation_kwargs(self):
+        kwargs = {
+            'wrapper': self.computation_wrapper,
+            'wrapper_vis': self.computation_wrapper_vis,
+            'time_limit': self.time_limit,
+            'cpu_limit': self.cpu_limit,
+            'memory_limit': self.memory_limit
+        }
+        if self.computation_harness is not None:
+            kwargs['harness'] = self.computation_harness
+        if self.fixture_generator is not None:
+            kwargs['generator'] = self.fixture_generator
+        return kwargs
+
+    def runtime_kwargs(self):
+        # Options of computations which do not affect their results
+        kwargs = {
+            'cores': self.cores,
+            'output_limit': self.output_limit,
+            'log_dir': self.log_dir,
+            'jobserver': self.jobserver
+        }
+        if self.fixture_generator is not None:
+            kwargs['fixture_dir'] = self.path('fixtures') # Shared by every ref
+        return kwargs
 
     @property
     def computation(self):
@@ -115,9 +281,11 @@ class Tester(object):
             return self._computation
 
     def get_computation(self):
-        return self.computation_type(self.project, working_dir=self.project_dir, wrapper=self.computation_wrapper, wrapper_vis=self.computation_wrapper_vis)
+        return self.computation_type(self.project, working_dir=self.project_dir, **dict(self.computation_kwargs(), **self.runtime_kwargs()))
 
     def cleanup(self):
+        if getattr(self, '_computation', None) is not None:
+            self._computation.close()
         self._computation = None
         self._cleanup()
 
@@ -130,39 +298,72 @@ class Tester(object):
         if not vis:
             result = self.cache(task=task, params=params)
         if result is None:
-            result = self.cache(value=self.computation.run(task,vis=vis,params=params),task=task,params=params)
+            result = self.cache(value=self.execute(self.computation,task,vis=vis,params=params),task=task,params=params)
         if print_info:
             result.pretty_print()
         return result
 
+    def execute(self, computation, task, vis=False, params={}):
+        if self.benchmark is None or vis:
+            return computation.run(task, vis=vis, params=params)
+        return self.benchmark.measure(lambda: computation.run(task, params=params))
+
     def score(self, *args, **kwargs):
         return self.run(*args,**kwargs).score
 
-    def __tasks(self,count=1, tasks=None):
+    def _tasks(self,count=1, tasks=None):
         if tasks is None:
             return range(1,count+1)
         return tasks
 
     def iterate_score(self,*args,**kwargs):
-        results = self.iterate(*args,**kwargs)
-        def scores(r):
-            return r.score
-        return np.vectorize(scores)(results).astype(float)
+        return self.iterate(*args,**kwargs).field('score')
 
     def __prepare_iterate(self, tasks, params={}, ranges=None):
         # Make sure we have initialised the computation before the fork in ranges_iterator
         # Return True if all done
-        if ranges is not None:
-            self.computation
+        if ranges is not None or not self.__use_cache:
+            self.__prepare_computation()
+            return False
+        try:
+            keys = [self.get_cache_key(task=task, params=params) for task in tasks]
+        except ValueError:
+            keys = None
+        if keys is None or len(self.cache_missing(keys)) > 0:
+            self.__prepare_computation()
             return False
-        for task in tasks:
-            if self.cache(task=task, params=params) is None:
-                self.computation
-                return False
         return True
 
+    def __prepare_computation(self):
+        self.computation
+        if self.__use_cache:
+            self.get_digest() # Computed here so that forked workers inherit it.
+
+    def _iter_opts(self, iter_opts):
+        # With pinned runs, there is no point in more workers than CPUs.
+        iter_opts = iter_opts.copy()
+        if self.cores is not None:
+            nprocs = iter_opts.get('nprocs')
+            if nprocs is None or nprocs < 0 or nprocs > len(self.cores):
+                iter_opts['nprocs'] = len(self.cores)
+        return iter_opts
+
+    executors = {
+        'threads': Scheduler,
+        'eventloop': EventLoop,
+        'cluster': Coordinator
+    }
+
     def iterate(self,count=1,tasks=None,ranges=None,params={},iter_opts={}):
-        tasks = self.__tasks(count, tasks)
+        tasks = self._tasks(count, tasks)
+        iter_opts = self._iter_opts(iter_opts)
+
+        if iter_opts.get('executor') is not None or iter_opts.get('journal'):
+            return self.__iterate_units(tasks, ranges, params, iter_opts)
+        iter_opts.pop('executor', None)
+        iter_opts.pop('executor_opts', None)
+        iter_opts.pop('longest_first', None)
+        iter_opts.pop('journal', None)
 
         if self.__prepare_iterate(tasks, params=params, ranges=ranges):
             iter_opts = {}
@@ -180,31 +381,256 @@ class Tester(object):
             return self.run(task=task, params=params)
 
         iterator = self.p.ranges_iterator(ranges, params=params, function=f, **iter_opts)
-        results = np.empty(iterator.ranges_eval.shape, dtype=object)
+        results = ResultSet(iterator.ranges_eval.shape)
         for index,data in iterator:
             results[index] = data
             self.cache_sync()
+        self.cache_sync(force=True)
+        return results
+
+    def _expand_ranges(self, ranges, params={}):
+        '''
+        Return the shape of the grid spanned by `ranges` (as passed to
+        `iterate`), and a list of (index, params) for each of its points.
+        '''
+        axes = []
+        for r in ranges:
+            names = r.keys()
+            values = [self.p.range(name, **r) for name in names]
+            axes.append([dict(zip(names, point)) for point in zip(*values)])
+        shape = tuple(len(axis) for axis in axes)
+        points = []
+        for index in np.ndindex(*shape):
+            point = params.copy()
+            for axis, i in zip(axes, index):
+                point.update(axis[i])
+            points.append((index, point))
+        return shape, points
+
+    def __iterate_units(self, tasks, ranges, params, iter_opts):
+        # Iterate using one of our own executors rather than parampy's
+        results = None
+        for _, _, results in self.stream(tasks=tasks, ranges=ranges, params=params, iter_opts=iter_opts):
+            pass
+        if results is None:
+            results = ResultSet(self.__sweep(tasks, ranges, params)[0])
         return results
 
-    def plot_dependence(self, output="dependence", **kwargs):
+    def stream(self, count=1, tasks=None, ranges=None, params={}, iter_opts={}):
+        '''
+        As for `iterate`, but yield (index, result, results) as each point of
+        the grid is done.
+        '''
+        tasks = self._tasks(count, tasks)
+        shape, indices, units = self.__sweep(tasks, ranges, params)
+        results = ResultSet(shape)
+        for _, (task, point), result in self.evaluate([self.work_group(units)], iter_opts=iter_opts):
+            for index in indices[(task, tuple(canonical_params(point)))]:
+                results[index] = result
+                yield index, result, results
+
+    def __sweep(self, tasks, ranges, params):
+        # The shape of the grid, the indices of each distinct unit in it, and
+        # the distinct units.
+        if ranges is None:
+            ranges = []
+        if type(ranges) is dict:
+            ranges = [ranges]
+        shape, points = self._expand_ranges([{'task':tasks}] + list(ranges), params)
+
+        indices = {}
+        units = []
+        for index, point in points:
+            task = int(point.pop('task'))
+            key = (task, tuple(canonical_params(point)))
+            if key not in indices:
+                indices[key] = []
+                units.append((task, point))
+            indices[key].append(index)
+        return shape, indices, units
+
+    def work_group(self, units, name=None, priority=None):
+        return WorkGroup(name, units, build=lambda: self.computation, priority=priority)
+
+    def evaluate(self, groups, iter_opts={}):
+        '''
+        Evaluate several work groups on one pool of workers, yielding (group
+        name, unit, result) as results become available.
+        '''
+        iter_opts = self._iter_opts(iter_opts)
+        executor = self.executors[iter_opts.get('executor') or 'threads']
+        makespan = Makespan()
+        scheduler = executor(nprocs=iter_opts.get('nprocs'), builders=iter_opts.get('builders', 1), execute=self.execute if self.benchmark is not None else None, started=makespan.started, **iter_opts.get('executor_opts', {}))
+        makespan.nprocs = getattr(scheduler, 'nprocs', None)
+        self.makespans.append(makespan)
+        lookahead = iter_opts.get('lookahead', 2)
+        longest_first = iter_opts.get('longest_first', True)
+        runtimes = self.runtimes
+        self.load_runtimes([unit for group in groups for unit in group.units])
+
+        def expected(unit):
+            return runtimes.expected(int(unit[0]), tuple(canonical_params(unit[1])))
+
+        def record(unit, result):
+            if getattr(result, 'runtime', None) is not None:
+                runtimes.record(int(unit[0]), tuple(canonical_params(unit[1])), float(result.runtime))
+
+        journal = self.journal(groups) if iter_opts.get('journal') else None
+        stored = self.__use_cache or journal is not None
+
+        def lookup(task, params, digest):
+            key = self.get_cache_key(task, params, digest=digest)
+            result = journal.get(key) if journal is not None else None
+            if result is None and self.__use_cache:
+                result = self.cache_get(key)
+            return result
+
+        waiting = list(enumerate(groups))
+        active = {} # index -> [group, computation, digest, units remaining]
+        complete = False
+
+        try:
+            while len(waiting) > 0 or len(active) > 0:
+                while len(waiting) > 0 and len(active) < lookahead:
+                    index, group = waiting.pop(0)
+                    units = group.units
+                    if stored and group.digest is not None:
+                        units = []
+                        for task, params in group.units:
+                            result = lookup(task, params, group.digest)
+                            if result is None:
+                                units.append((task, params))
+                            else:
+                                record((task, params), result)
+                                yield group.name, (task, params), result
+                    if len(units) > 0:
+                        active[index] = [group, None, group.digest, units]
+                        scheduler.build(index, group.build)
+
+                if len(active) == 0:
+                    continue
+
+                event = scheduler.next_event()
+                index = event[1]
+                group, computation, digest, units = active[index]
+
+                if event[0] == 'built':
+                    computation = active[index][1] = event[2]
+                    if stored:
+                        digest = active[index][2] = group.built(computation)
+                    remaining = []
+                    if longest_first and group.priority is None:
+                        # Units of equal priority are started in the order they are submitted.
+                        units = sorted(units, key=expected, reverse=True)
+                    for task, params in units:
+                        result = None
+                        if stored:
+                            result = lookup(task, params, digest)
+                        if result is None:
+                            remaining.append((task, params))
+                            scheduler.run(index, computation, task, params, priority=index if group.priority is None else group.priority(task, params))
+                        else:
+                            record((task, params), result)
+                            yield group.name, (task, params), result
+                    active[index][3] = remaining
+                else:
+                    unit, result = event[2], event[3]
+                    units.remove(unit)
+                    record(unit, result)
+                    makespan.finished(float(getattr(result, 'runtime', None) or 0.))
+                    if stored:
+                        key = self.get_cache_key(unit[0], unit[1], digest=digest)
+                        if journal is not None:
+                            journal.append(key, result)
+                        if self.__use_cache:
+                            self.cache_put(key, result)
+                    yield group.name, unit, result
+
+                if len(active[index][3]) == 0:
+                    group.release(computation)
+                    del active[index]
+            complete = True
+        finally:
+            scheduler.close()
+            for group, computation, _, _ in active.values():
+                if computation is not None:
+                    group.release(computation)
+            self.save_runtimes()
+            self.cache_sync(force=True)
+            if journal is not None:
+                # Once every unit is complete, the journal is no longer needed.
+                if complete:
+                    journal.remove()
+                else:
+                    journal.close()
+
+    def journal(self, groups):
+        '''
+        The Journal of an evaluation of `groups`, which is shared by every
+        evaluation of the same units in groups of the same names and sources
+        (such as refs) with the same configuration.
+        '''
+        spec = (self.get_config_key(), repr(self.benchmark), [(group.name, group.source, [(int(task), canonical_params(params)) for task, params in group.units]) for group in groups])
+        return Journal(self.path(os.path.join('journals', hashlib.sha1(repr(spec)).hexdigest())))
+
+    def iterate_score_adaptive(self, budget, count=1, tasks=None, ranges=None, params={}, coarse=2, iter_opts={}):
+        '''
+        The total score over the tasks at each point of `ranges`, running at
+        most `budget` points and interpolating the rest.
+        '''
+        tasks = self._tasks(count, tasks)
+        if ranges is None:
+            ranges = []
+        if type(ranges) is dict:
+            ranges = [ranges]
+        shape, points = self._expand_ranges(ranges, params)
+        points = dict(points)
+
+        def evaluate(indices):
+            units = [(task, points[index]) for index in indices for task in tasks]
+            scores = [result.score for result in self.evaluate_units(units, iter_opts=iter_opts)]
+            return [sum(scores[i*len(tasks):(i+1)*len(tasks)]) for i in range(len(indices))]
+
+        grid = GridRefinement(shape, coarse=coarse)
+        grid.sample(evaluate, budget)
+        return grid.interpolate()
+
+    def plot_dependence(self, output="dependence", budget=None, **kwargs):
+        '''
+        Plot the total score against one or two parameters. If `budget` is
+        not None, at most that many points of the grid are run, chosen
+        adaptively (see `iterate_score_adaptive`).
+        '''
         ranges = kwargs.get('ranges',[])
+        if type(ranges) is dict:
+            ranges = [ranges]
+        ranges = list(ranges) # `iterate` adds the task axis to the list it is passed.
         if len(ranges) == 0:
             raise ValueError("Need to iterate over some value.")
 
-        results = np.sum(self.iterate_score(**kwargs),axis=0)
+        if budget is not None:
+            results = self.iterate_score_adaptive(budget, **kwargs)
+        else:
+            results = np.sum(self.iterate_score(**kwargs),axis=0)
+
+        import matplotlib
+        matplotlib.use('agg')
+        import matplotlib.pyplot as plt
+        from mplstyles import SampleStyle, contour_image
+
         style = SampleStyle()
         with style:
             if len(results.shape) == 1:
-                var = ranges[1].keys()[0]
-                xs = self.p.range(var, **ranges[1])
+                var = ranges[0].keys()[0]
+                xs = self.p.range(var, **ranges[0])
                 plt.plot(xs, results)
                 plt.xlabel(r"\verb!%s!" % var)
                 plt.ylabel("Score")
             elif len(results.shape) == 2:
-                var_x = ranges[1].keys()[0]
-                var_y =  ranges[2].keys()[0]
-                xs = self.p.range(var_x, **ranges[1])
-                ys = self.p.range(var_y, **ranges[2])
+                var_x = ranges[0].keys()[0]
+                var_y =  ranges[1].keys()[0]
+                xs = self.p.range(var_x, **ranges[0])
+                ys = self.p.range(var_y, **ranges[1])
                 contour_image(xs, ys, results, cguides=True, label=True, cmap=plt.get_cmap('hsv'))
                 plt.xlabel(r"\verb!%s!" % var_x)
                 plt.ylabel(r"\verb!%s!" % var_y)
@@ -212,22 +638,55 @@ class Tester(object):
                 raise ValueError("Cannot plot more than 2 dimensions.")
             style.savefig(os.path.join(self.project_dir,output+".pdf"))
 
-    def optimise(self,opt_params=[],count=1,tasks=None,params={},opt_opts={}):
+    optimisers = {
+        'evolution': DifferentialEvolution
+    }
+
+    def optimise(self,opt_params=[],count=1,tasks=None,params={},opt_opts={},method=None,bounds=None,iter_opts={}):
         '''
-        This will only work for non-discrete scores.
+        This will only work for non-discrete scores, unless `method` names one
+        of `optimisers`.
         '''
+        if method is not None:
+            return self.__optimise_population(method, opt_params, count, tasks, params, opt_opts, bounds, iter_opts)
         x0 = []
         for opt_param in opt_params:
             if opt_param not in params:
                 raise ValueError("Default value must be supplied for %s" % opt_param)
             x0.append(params[opt_param])
         f = self.__iterate_wrapper(opt_params, count, tasks, params)
+        import scipy.optimize as spo
         r = spo.minimize(f, x0, tol=1e-3, **opt_opts)
         x = {}
         for i,opt_param in enumerate(opt_params):
             x[opt_param] = r.x[i]
         return x, r.success
 
+    def __optimise_population(self, method, opt_params, count, tasks, params, opt_opts, bounds, iter_opts):
+        if method not in self.optimisers:
+            raise ValueError("Invalid optimiser: %s" % method)
+        if bounds is None or set(bounds) != set(opt_params):
+            raise ValueError("Bounds must be supplied for each of %s" % ', '.join(opt_params))
+        opt_opts = opt_opts.copy()
+        opt_opts.setdefault('integers', [name for name in opt_params if isinstance(params.get(name), (int, long))])
+        optimiser = self.optimisers[method](bounds, **opt_opts)
+
+        def evaluate(units):
+            units = [(task, dict(params, **candidate)) for task, candidate in units]
+            return [result.score for result in self.evaluate_units(units, iter_opts=iter_opts)]
+
+        return optimiser.maximise(evaluate, self._tasks(count, tasks)), True
+
+    def evaluate_units(self, units, iter_opts={}):
+        '''
+        Evaluate a list of (task, params) units as one batch, returning their
+        results in the same order.
+        '''
+        results = {}
+        for _, (task, params), result in self.evaluate([self.work_group(units)], iter_opts=iter_opts):
+            results[(task, tuple(canonical_params(params)))] = result
+        return [results[(task, tuple(canonical_params(params)))] for task, params in units]
+
     def __iterate_wrapper(self,opt_params=[],count=1,tasks=None,params={}):
         params = params.copy()
         def wrapped(x):
@@ -241,11 +700,20 @@ class Tester(object):
 
     def __exit__(self,type,value,traceback):
         self.cleanup()
+        self.close()
 
     def __del__(self):
         self.cleanup()
-        if getattr(self,'_Tester__cache',None) is not None:
-            self.__cache.close()
+        self.close()
+
+    def close(self):
+        if getattr(self,'_Tester__store',None) is not None:
+            self.cache_sync(force=True)
+            self.__store.close()
+            self.__store = None
+        if getattr(self, 'jobserver', None) is not None:
+            self.jobserver.close()
+            self.jobserver = None
 
     def save_config(self):
         s = shelve.open(self.path('tester_init.config'), protocol=0)
@@ -266,8 +734,14 @@ class Tester(object):
 
 class GitTester(Tester):
 
-    def init(self, ref='master'):
+    def init(self, ref='master', artifact_cache_size=1024):
+        import git
         self.__project_repo = git.Repo(self.project_dir)
+        self.__worktrees = WorktreePool(self.project_dir, self.path('worktrees'))
+        self.artifacts = None
+        if artifact_cache_size > 0:
+            self.artifacts = ArtifactCache(self.path('artifacts'), max_size=artifact_cache_size*1024*1024)
+        self.__digests = {}
         self.ref = ref
 
     @property
@@ -280,58 +754,137 @@ class GitTester(Tester):
 
     def get_repo_dir(self):
         if getattr(self,'_repo_path',None) is None:
-            self._repo_path = tempfile.mkdtemp()
-        return self._repo_path # self.path('checkout')#self.path(self.ref)
-
-    def get_cache_key(self, task=0, params={}):
-        ref = str(self.__project_repo.commit(self.ref).hexsha)
-        return '%s_%d'%(ref,task)
-
-    def __get_ref(self, repo, ref):
+            self._repo_path = self.__worktrees.acquire(self.__get_ref(self.ref))
+        return self._repo_path
+
+    def get_digest(self):
+        ref = self.__get_ref(self.ref)
+        digest = self.known_digest(ref)
+        if digest is None:
+            digest = self.remember_digest(ref, self.computation.digest())
+        return digest
+
+    # Remember which artifact each commit builds to, so that cached results
+    # can be found without checking out and building the commit again.
+    def digest_key(self, ref):
+        # The generator's files may change without the ref changing.
+        identity = self.get_config_key()
+        if self.fixture_generator is not None:
+            identity = hashlib.sha1(repr((identity, generator_identity(self.fixture_generator, src_dir=self.project_dir, working_dir=self.project_dir)))).hexdigest()
+        return 'digest_%s_%s' % (ref, identity)
+
+    def known_digest(self, ref):
+        if ref not in self.__digests:
+            digest = self.cache_get(self.digest_key(ref))
+            if digest is None:
+                return None
+            self.__digests[ref] = digest
+        return self.__digests[ref]
+
+    def remember_digest(self, ref, digest):
+        self.__digests[ref] = self.cache_put(self.digest_key(ref), digest)
+        return digest
+
+    def __get_ref(self, ref):
         try:
-            repo.commit(ref)
-            return ref
+            return str(self.__project_repo.commit(ref).hexsha)
         except:
-            return repo.commit('origin/'+ref).hexsha
+            return str(self.__project_repo.commit('origin/'+ref).hexsha)
+
+    def get_computation(self, ref=None):
+        # Computations for refs other than self.ref are checked out into their
+        # own worktree, which should be handed back with release_computation.
+        with tracing.span('checkout', ref=self.ref if ref is None else ref):
+            if ref is None:
+                ref = self.__get_ref(self.ref)
+                d = self.get_repo_dir()
+            else:
+                ref = self.__get_ref(ref)
+                d = self.__worktrees.acquire(ref)
+        source = self.__project_repo.commit(ref).tree.hexsha
+        return self.computation_type(self.project, working_dir=d, src_dir=self.project_dir, artifacts=self.artifacts, source=source, **dict(self.computation_kwargs(), **self.runtime_kwargs()))
 
-    def get_computation(self):
-        d = self.get_repo_dir()
-        if os.path.exists(d) and os.path.exists(os.path.join(d,'.git')):
-            self.__repo = git.Repo(d)
-            self.__repo.remotes.origin.pull()
-        else:
-            self.__repo = git.Repo(self.project_dir).clone(d)
-        self.__repo.git.checkout(self.__get_ref(self.__repo, self.ref))
-        return self.computation_type(self.project, working_dir=d, src_dir=self.project_dir, wrapper=self.computation_wrapper, wrapper_vis=self.computation_wrapper_vis)
+    def release_computation(self, computation):
+        computation.close()
+        self.__worktrees.release(computation.working_dir)
 
     def _cleanup(self):
-        if getattr(self, '_GitTester__ref', None) is not None:
-            d = self.get_repo_dir()
-            _repo_path = None
-            if os.path.exists(d):
-                shutil.rmtree(d)
-
-    def annotate_commits(self, count=1, output='history', branches=None, since=None, iter_opts={}):
-        from .utils import GitAnnotate, get_commits_by_branch
+        if getattr(self, '_repo_path', None) is not None:
+            self.__worktrees.release(self._repo_path)
+            self._repo_path = None
+
+    def work_group(self, units, name=None, ref=None, priority=None):
+        ref = self.__get_ref(self.ref if ref is None else ref)
+        return WorkGroup(ref if name is None else name, units,
+                    build=lambda: self.__build(ref),
+                    digest=self.known_digest(ref),
+                    built=lambda computation: self.remember_digest(ref, computation.digest()),
+                    release=self.release_computation,
+                    priority=priority,
+                    source=ref)
+
+    def __build(self, ref):
+        # Compiled in the builder thread too, so that several refs (such as
+        # those being compared) are built at once.
+        computation = self.get_computation(ref=ref)
+        try:
+            computation.compile()
+        except:
+            self.release_computation(computation)
+            raise
+        return computation
+
+    def annotation_key(self, tasks, params={}, field='score'):
+        # Stored totals of `field` over `tasks` for a commit, as used by
+        # annotate_commits and bisect. The totals of scores with no params
+        # keep the key they were first stored under, by annotate_commits.
+        if not params and field == 'score':
+            return hashlib.sha1(repr((self.get_config_key(), list(tasks), repr(self.benchmark)))).hexdigest()
+        return hashlib.sha1(repr((self.get_config_key(), list(tasks), canonical_params(params), field, repr(self.benchmark)))).hexdigest()
+
+    def annotate_commits(self, count=1, output='history', branches=None, since=None, force=False, iter_opts={}):
+        '''
+        Draw the history of the repository, annotated with the total score of
+        each commit.
+        '''
+        from .utils import GitAnnotate, CommitIndex, get_commits_by_branch
 
-        annotations = {}
-        branches, commits, all_commits = get_commits_by_branch(repo=self.project_dir, branches=branches)
+        index = CommitIndex(self.path('commit_index'))
+        history = get_commits_by_branch(repo=self.project_dir, branches=branches, index=index)
+        index.save()
+        branches, commits, all_commits = history
 
         going = False
         if since is None:
             going = True
 
-        max_score = -1
-
+        tasks = self._tasks(count)
+        key = 'annotation_%%s_%s' % self.annotation_key(tasks)
+        annotations = {}
+        groups = []
+        units = [(task, {}) for task in tasks]
         for commit in all_commits:
             if not going and commit.hexsha.startswith(since):
                 going = True
-            if going:
-                self.ref = commit.hexsha
-                score = np.sum(self.iterate_score(count=count, iter_opts=iter_opts))
-                if score > max_score:
-                    max_score = score
+            score = None
+            if self.caching and not force:
+                score = self.cache_get(key % commit.hexsha)
+            if score is not None:
                 annotations[commit.hexsha] = score
+            elif going:
+                annotations[commit.hexsha] = 0.
+                groups.append(self.work_group(units, ref=commit.hexsha))
+
+        # All commits share one pool of workers, with the builds of upcoming
+        # commits overlapping the runs of the current ones.
+        remaining = dict((group.name, len(units)) for group in groups)
+        for ref, unit, result in self.evaluate(groups, iter_opts=iter_opts):
+            annotations[ref] += result.score
+            remaining[ref] -= 1
+            if remaining[ref] == 0 and self.caching:
+                self.cache_put(key % ref, annotations[ref])
+
+        max_score = max(annotations.values() + [-1])
 
         if max_score in (0,-1):
             max_score = 1
@@ -343,30 +896,159 @@ class GitTester(Tester):
         for commit, score in annotations.items():
             annotations[commit] = (scale(score), str(score))
 
-        GitAnnotate(output=os.path.join(self.project_dir,output), repo=self.project_dir, annotate=annotations, branches=branches)
+        GitAnnotate(output=os.path.join(self.project_dir,output), repo=self.project_dir, annotate=annotations, branches=branches, history=history)
+
+    def _compare_events(self, ref, tasks, params={}, iter_opts={}):
+        # The results of the current ref ('old') and `ref` ('new') on `tasks`,
+        # as they come from `evaluate`. Both refs are built at once, and their
+        # units interleaved in task order.
+        order = dict((task, i) for i, task in enumerate(tasks))
+        priority = lambda task, params: order[task]
+        units = [(task, params) for task in tasks]
+        groups = [self.work_group(units, name='old', priority=priority), self.work_group(units, name='new', ref=ref, priority=priority)]
+        iter_opts = dict(iter_opts)
+        iter_opts.setdefault('builders', 2)
+        return self.evaluate(groups, iter_opts=iter_opts)
 
     def compare(self, ref, output=None, count=1,fields=['score'],tasks=None,params={},iter_opts={}):
+        '''
+        Compare `ref` against the current ref on the same tasks.
+        '''
         from .utils import DiffArray
 
-        base = self.ref
-
         if output is None:
-            output = "(%s) <- (%s) " % (ref, base)
+            output = "(%s) <- (%s) " % (ref, self.ref)
 
-        results_old = self.iterate(count=count, tasks=tasks, params=params, iter_opts=iter_opts)
-        self.ref = ref
-        results_new = self.iterate(count=count, tasks=tasks, params=params, iter_opts=iter_opts)
-        self.ref = base
+        tasks = self._tasks(count, tasks)
+        order = dict((task, i) for i, task in enumerate(tasks))
+        results = {'old': ResultSet((len(tasks),)), 'new': ResultSet((len(tasks),))}
+        for name, (task, _), result in self._compare_events(ref, tasks, params, iter_opts):
+            results[name][order[task]] = result
+        results_old, results_new = results['old'], results['new']
 
-        def get_map(field):
-            def f(a):
-                try:
-                    return a.info[field]
-                except:
-                    return getattr(a,field)
-            return np.vectorize(f)
+        for field in fields:
+            DiffArray(output=os.path.join(self.project_dir, output+field), new=results_new.field(field).astype(float), old=results_old.field(field).astype(float), tasks=tasks, maximise=field not in ComputationResult.minimise)
 
-        tasks = get_map('task')(results_new).flatten().tolist()
+    def compare_sequential(self, ref, output=None, count=100, field='score', tasks=None, params={}, alpha=0.05, beta=0.05, delta=0.1, iter_opts={}):
+        '''
+        Compare `ref` against the current ref until a SignTest is decided.
+        '''
+        from .utils import DiffArray
 
-        for field in fields:
-            DiffArray(output=os.path.join(self.project_dir, output+field), new=get_map(field)(results_new).astype(float), old=get_map(field)(results_old).astype(float), tasks=tasks, maximise=field not in ComputationResult.minimise)
+        if output is None:
+            output = "(%s) <- (%s) " % (ref, self.ref)
+
+        tasks = self._tasks(count, tasks)
+
+        test = SignTest(alpha=alpha, beta=beta, delta=delta)
+        maximise = field not in ComputationResult.minimise
+        unpaired = {'old': {}, 'new': {}}
+        pairs = []
+        wins = losses = 0
+        decision = 0
+
+        events = self._compare_events(ref, tasks, params, iter_opts)
+        try:
+            for name, (task, _), result in events:
+                unpaired[name][task] = float(getattr(result, field))
+                if task not in unpaired['old'] or task not in unpaired['new']:
+                    continue
+                old, new = unpaired['old'].pop(task), unpaired['new'].pop(task)
+                pairs.append((task, old, new))
+                diff = new - old if maximise else old - new
+                wins += diff > 0
+                losses += diff < 0
+                decision = test.decide(wins, losses)
+                if decision != 0:
+                    break
+        finally:
+            events.close()
+
+        if len(pairs) > 0:
+            DiffArray(output=os.path.join(self.project_dir, output+field), new=np.array([p[2] for p in pairs]), old=np.array([p[1] for p in pairs]), tasks=[p[0] for p in pairs], maximise=maximise)
+
+        return {
+            'decision': {1: 'better', -1: 'worse', 0: 'inconclusive'}[decision],
+            'pairs': len(pairs),
+            'wins': wins,
+            'losses': losses,
+            'ties': len(pairs) - wins - losses,
+            'los': likelihood_of_superiority(wins, losses),
+            'llr': test.llr(wins, losses),
+        }
+
+    def bisect(self, good, bad, threshold=None, count=1, field='score', tasks=None, params={}, probes=None, iter_opts={}):
+        '''
+        Find the first commit between `good` and `bad` whose total `field` is
+        worse than `threshold`.
+        '''
+        good, bad = self.__get_ref(good), self.__get_ref(bad)
+        commits = [good] + self.__project_repo.git.rev_list('--first-parent', '--ancestry-path', '--reverse', '%s..%s' % (good, bad)).split()
+        if commits[-1] != bad:
+            raise ValueError("%s is not an ancestor of %s along its first parents." % (good, bad))
+
+        tasks = self._tasks(count, tasks)
+        units = [(task, params) for task in tasks]
+        key = 'annotation_%%s_%s' % self.annotation_key(tasks, params, field)
+        maximise = field not in ComputationResult.minimise
+
+        if probes is None:
+            probes = max(1, resolve_nprocs(self._iter_opts(iter_opts).get('nprocs'))//len(tasks))
+
+        totals = {}
+        def measure(refs):
+            groups = []
+            for ref in refs:
+                if ref in totals:
+                    continue
+                total = self.cache_get(key % ref) if self.caching else None
+                if total is None:
+                    groups.append(self.work_group(units, ref=ref))
+                else:
+                    totals[ref] = total
+            if len(groups) == 0:
+                return
+            # Build and run all of the probes together.
+            measured = dict((group.name, 0.) for group in groups)
+            opts = dict(iter_opts, lookahead=max(iter_opts.get('lookahead', 2), len(groups)))
+            for ref, unit, result in self.evaluate(groups, iter_opts=opts):
+                measured[ref] += float(getattr(result, field))
+            for ref, total in measured.items():
+                totals[ref] = self.cache_put(key % ref, total) if self.caching else total
+
+        def regressed(ref):
+            return totals[ref] < threshold if maximise else totals[ref] > threshold
+
+        lo, hi = 0, len(commits) - 1
+        if threshold is None:
+            measure([good, bad])
+            threshold = (totals[good] + totals[bad])/2.
+
+        rounds = 0
+        while hi - lo > 1 or rounds == 0:
+            k = min(probes, hi - lo - 1)
+            indices = sorted(set(lo + (hi - lo)*(i + 1)//(k + 1) for i in range(k)))
+            # The ends are checked along with the first probes.
+            measure(([good, bad] if rounds == 0 else []) + [commits[i] for i in indices])
+            if rounds == 0:
+                if regressed(good):
+                    raise ValueError("%s is already worse than the threshold %s (with a total %s of %s)." % (good, threshold, field, totals[good]))
+                if not regressed(bad):
+                    raise ValueError("%s is not worse than the threshold %s (with a total %s of %s)." % (bad, threshold, field, totals[bad]))
+            rounds += 1
+            for i in indices:
+                if regressed(commits[i]):
+                    hi = i
+                    break
+                lo = i
+
+        return {
+            'commit': commits[hi],
+            'total': totals[commits[hi]],
+            'previous': commits[lo],
+            'previous_total': totals[commits[lo]],
+            'threshold': threshold,
+            'rounds': rounds,
+            'evaluated': len(totals),
+            'commits': len(commits),
+        }
@@ -0,0 +1,121 @@
+'''
+Tracing of relentless's own work, written as a Chrome trace; off unless
+`start` is called (or $RELENTLESS_TRACE names a directory).
+'''
+
+import os
+import json
+import time
+import glob
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_file = None
+_pid = None
+
+
+def directory():
+    return os.environ.get('RELENTLESS_TRACE') or None
+
+def enabled():
+    return directory() is not None
+
+def start(path=None):
+    '''
+    Start tracing into the directory `path` (by default a new temporary one),
+    which is inherited by child processes through the environment.
+    '''
+    if path is None:
+        path = tempfile.mkdtemp(prefix='relentless-trace-')
+    if not os.path.exists(path):
+        os.makedirs(path)
+    os.environ['RELENTLESS_TRACE'] = os.path.abspath(path)
+    return path
+
+def record(name, start, end, **args):
+    '''
+    Record a span `name` which ran from `start` to `end` (in seconds since the
+    epoch), with `args` describing it.
+    '''
+    global _file, _pid
+    path = directory()
+    if path is None:
+        return
+    event = {
+        'name': name,
+        'cat': name.split(' ')[0],
+        'ph': 'X',
+        'ts': int(start*1e6),
+        'dur': int((end - start)*1e6),
+        'pid': os.getpid(),
+        'tid': threading.current_thread().ident,
+        'args': dict((key, str(value)) for key, value in args.items()),
+    }
+    with _lock:
+        if _file is None or _pid != os.getpid():
+            # Forked processes write to files of their own.
+            _pid = os.getpid()
+            _file = open(os.path.join(path, '%d.jsonl' % _pid), 'a', 1)
+        _file.write(json.dumps(event) + '\n')
+
+@contextmanager
+def span(name, **args):
+    if not enabled():
+        yield
+        return
+    begin = time.time()
+    try:
+        yield
+    finally:
+        record(name, begin, time.time(), **args)
+
+def events(path=None):
+    path = path or directory()
+    recorded = []
+    for filename in sorted(glob.glob(os.path.join(path, '*.jsonl'))):
+        with open(filename) as f:
+            for line in f:
+                try:
+                    recorded.append(json.loads(line))
+                except ValueError:
+                    pass # A line cut short by a killed worker
+    recorded.sort(key=lambda event: event['ts'])
+    return recorded
+
+def summarise(events):
+    '''
+    Return a table of the number, total, mean and maximum duration (in
+    seconds) of the spans of each name. Totals are summed over all processes
+    and threads, and so may exceed the wall time.
+    '''
+    phases = {}
+    for event in events:
+        phases.setdefault(event['name'], []).append(event['dur']/1e6)
+    lines = ["%-20s %8s %10s %10s %10s" % ('phase', 'count', 'total', 'mean', 'max')]
+    for name, durations in sorted(phases.items(), key=lambda item: -sum(item[1])):
+        lines.append("%-20s %8d %10.3f %10.3f %10.3f" % (name, len(durations), sum(durations), sum(durations)/len(durations), max(durations)))
+    return '\n'.join(lines)
+
+def finish(output, remove=True):
+    '''
+    Merge the spans recorded so far into a Chrome trace at `output`, stop
+    tracing, and return a summary of the phases (see `summarise`).
+    '''
+    global _file
+    path = directory()
+    if path is None:
+        raise RuntimeError("Tracing has not been started.")
+    with _lock:
+        if _file is not None:
+            _file.close()
+            _file = None
+    recorded = events(path)
+    with open(output, 'w') as f:
+        json.dump({'traceEvents': recorded, 'displayTimeUnit': 'ms'}, f)
+    del os.environ['RELENTLESS_TRACE']
+    if remove:
+        shutil.rmtree(path, ignore_errors=True)
+    return summarise(recorded)
@@ -1,14 +1,66 @@
 import git
 import subprocess
 import os
+import cPickle as pickle
+from collections import namedtuple
 from .xelatex import XeLaTeX
 
-def get_commits_by_branch(repo='.',branches=None):
+Commit = namedtuple('Commit', ['hexsha', 'parents', 'committed_date', 'message'])
+
+class CommitIndex(object):
+    '''
+    The commit graph of a repository, with what is needed to draw it, kept in a
+    file at `path` (if given) so that only the commits made since it was last
+    saved need to be read from git.
+    '''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.commits = {}
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    self.commits = dict((sha, Commit(*commit)) for sha, commit in pickle.load(f).items())
+            except Exception:
+                self.commits = {} # Rebuilt from git
+
+    def save(self):
+        if self.path is None:
+            return
+        with open(self.path + '.tmp', 'wb') as f:
+            pickle.dump(dict((sha, tuple(commit)) for sha, commit in self.commits.items()), f, protocol=2)
+        os.rename(self.path + '.tmp', self.path)
+
+    def history(self, repo, tip):
+        '''
+        Return the commits reachable from the commit `tip` of `repo` (a
+        git.Repo), reading only those not yet indexed.
+        '''
+        seen = set()
+        stack = [tip]
+        history = []
+        while len(stack) > 0:
+            sha = stack.pop()
+            if sha in seen:
+                continue
+            seen.add(sha)
+            commit = self.commits.get(sha)
+            if commit is None:
+                c = repo.commit(sha)
+                commit = self.commits[sha] = Commit(sha, tuple(parent.hexsha for parent in c.parents), c.committed_date, c.message)
+            history.append(commit)
+            stack.extend(commit.parents)
+        return history
+
+def get_commits_by_branch(repo='.',branches=None,index=None):
 
     commits = {}
     all_commits = []
+    seen = set()
 
     r = git.Repo(repo)
+    if index is None:
+        index = CommitIndex()
 
     if branches is None:
         branches = [b.name for b in r.branches]
@@ -16,10 +68,10 @@ def get_commits_by_branch(repo='.',branches=None):
         branches.insert(0,'master')
 
     for branch in branches:
-        cs = []
-        for c in r.iter_commits(rev=branch):
-            cs.append(c)
-            if c not in all_commits:
+        cs = index.history(r, r.commit(branch).hexsha)
+        for c in cs:
+            if c.hexsha not in seen:
+                seen.add(c.hexsha)
                 all_commits.append(c)
         commits[branch] = cs
 
@@ -34,9 +86,11 @@ class GitAnnotate(XeLaTeX):
         with open(os.path.join(os.path.dirname(__file__),'templates','git_annotate.tex')) as f:
             return f.read()
 
-    def process(self, output='history', repo='.', annotate={}, branches=None):
+    def process(self, output='history', repo='.', annotate={}, branches=None, history=None):
 
-        branches, commits, all_commits = get_commits_by_branch(repo, branches)
+        if history is None:
+            history = get_commits_by_branch(repo, branches)
+        branches, commits, all_commits = history
 
         output = {}
 
@@ -48,12 +102,15 @@ class GitAnnotate(XeLaTeX):
             output['branches'].append( r"\branch{%d}{%s}" % (i, branch) )
         output['branches'] = '\n'.join(output['branches'])
 
+        # Each commit is drawn on the first branch which contains it.
+        first_branch = {}
+        for i, branch in reversed(list(enumerate(branches))):
+            for commit in commits[branch]:
+                first_branch[commit.hexsha] = i
+
         output['commits'] = []
         for d,commit in enumerate(all_commits):
-            for branch in branches:
-                if commit in commits[branch]:
-                    break
-            i = branches.index(branch)
+            i = first_branch.get(commit.hexsha, len(branches)-1)
             rel, value = annotate.get(commit.hexsha,(0,""))
 
             output['commits'].append( r"\commit{%d}{%d}{%s}{%s}{%f}{%s}" % (i, d, commit.hexsha[:7], commit.message, rel, value) )
@@ -62,7 +119,7 @@ class GitAnnotate(XeLaTeX):
         output['connects'] = []
         for d,commit in enumerate(all_commits):
             for parent in commit.parents:
-                output['connects'].append( r"\connect{%s}{%s};" % (parent.hexsha[:7], commit.hexsha[:7]) )
+                output['connects'].append( r"\connect{%s}{%s};" % (parent[:7], commit.hexsha[:7]) )
         output['connects'] = '\n'.join(output['connects'])
 
         return output
@@ -3,6 +3,7 @@ import subprocess
 import tempfile
 import os
 import shutil
+from .. import tracing
 
 class XeLaTeX(object):
 
@@ -27,7 +28,9 @@ class XeLaTeX(object):
 		f.close()
 
 	def compile(self):
-		process = subprocess.Popen(['xelatex','output'], cwd=self.tmpdir)
-		if process.wait() == 0:
+		with tracing.span('xelatex', output=self.dest):
+			process = subprocess.Popen(['xelatex','output'], cwd=self.tmpdir)
+			returncode = process.wait()
+		if returncode == 0:
 			shutil.copyfile(os.path.join(self.tmpdir, 'output.pdf'), self.dest+".pdf")
 		shutil.rmtree(self.tmpdir)
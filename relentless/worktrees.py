@@ -0,0 +1,89 @@
+import os
+import fcntl
+import threading
+
+
+class WorktreePool(object):
+    '''
+    A pool of `git worktree` checkouts of a repository, reused between commits.
+    '''
+
+    def __init__(self, repo_dir, path):
+        self.repo_dir = repo_dir
+        self.path = path
+        self.lock = threading.Lock()
+        self.__held = {}
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def acquire(self, commit):
+        '''
+        Return the path of a worktree checked out (detached) at `commit`, which
+        remains reserved for the caller until it is passed to `release`.
+        '''
+        with self.lock:
+            with open(os.path.join(self.path, '.pool.lock'), 'w') as pool_lock:
+                fcntl.flock(pool_lock, fcntl.LOCK_EX)
+                path = self.__reserve(commit)
+        import git
+        worktree = git.Git(path)
+        if worktree.rev_parse('HEAD') != commit:
+            worktree.checkout('--detach', '--force', commit)
+        return path
+
+    def release(self, path):
+        with self.lock:
+            handle = self.__held.pop(path, None)
+        if handle is not None:
+            os.utime(handle.name, None) # Most recently released worktrees are reused first.
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+
+    def worktrees(self):
+        return sorted(os.path.join(self.path, name) for name in os.listdir(self.path) if name.startswith('worktree-') and not name.endswith('.lock'))
+
+    def __reserve(self, commit):
+        free = []
+        for path in self.worktrees():
+            if not os.path.exists(os.path.join(path, '.git')):
+                continue
+            handle = open(path + '.lock', 'a')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                handle.close()
+                continue
+            free.append((path, handle))
+
+        if len(free) == 0:
+            path = self.__create(commit)
+            handle = open(path + '.lock', 'a')
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            free.append((path, handle))
+
+        # Prefer a worktree which is already at this commit, and otherwise
+        # whichever was released last (likely to be the closest in history).
+        import git
+        def preference(item):
+            path, handle = item
+            at_commit = git.Git(path).rev_parse('HEAD') == commit
+            return (at_commit, os.path.getmtime(handle.name))
+        free.sort(key=preference, reverse=True)
+
+        path, handle = free[0]
+        for _, other in free[1:]:
+            fcntl.flock(other, fcntl.LOCK_UN)
+            other.close()
+        self.__held[path] = handle
+        return path
+
+    def __create(self, commit):
+        import git
+        repo = git.Git(self.repo_dir)
+        repo.worktree('prune')
+        i = 0
+        while os.path.exists(os.path.join(self.path, 'worktree-%d' % i)):
+            i += 1
+        path = os.path.join(self.path, 'worktree-%d' % i)
+        repo.worktree('add', '--detach', path, commit)
+        return path